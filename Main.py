@@ -1,25 +1,167 @@
 import os
+import sys
+import csv
+import json
+import time
+import atexit
 import random
 import math
+import mmap
+import struct
+import bisect
+import threading
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from contextlib import contextmanager, nullcontext
+import weakref
 import pygame
 from os import listdir
 from os.path import isfile, join
-pygame.init()
 
-pygame.display.set_caption("Platformer")
+# Headless mode runs the game logic without a real window, e.g. for simulations
+HEADLESS = os.environ.get("PLATFORMER_HEADLESS") == "1"
 
 WIDTH, HEIGHT = 1000, 800
-FPS = 60
+FPS = 60  # Physics ticks per second
 PLAYER_VEL = 5
 
-window = pygame.display.set_mode((WIDTH, HEIGHT))
+# Rendering runs independently of physics, up to this many frames per second
+MAX_RENDER_FPS = 240
+TICK_MS = 1000 / FPS
+MAX_FRAME_MS = 250  # Longer frames drop physics time instead of slowing the game down
+
+
+def init_app(headless=HEADLESS):
+    """Open the game window, initializing only the pygame parts the game uses; returns the window.
+
+    Importing this module does not touch pygame, so the game logic can be used
+    without a display. Loading sprites and simulating levels work before this
+    is called; anything that shows or updates the window needs it first.
+    """
+    window = pygame.display.get_surface()
+    if window is not None:
+        return window
+    if headless:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.display.init()  # Also brings up the event queue; audio and joysticks stay off
+    pygame.font.init()
+    pygame.display.set_caption("Platformer")
+    return pygame.display.set_mode((WIDTH, HEIGHT))
+
+
+def load_image(path):
+    """Load an image, converted to the display's format when a window is open"""
+    image = pygame.image.load(path)
+    if pygame.display.get_init() and pygame.display.get_surface() is not None:
+        image = image.convert_alpha()
+    return image
 
 
 def flip(sprites):
     return [pygame.transform.flip(sprite, True, False) for sprite in sprites]
 
 
+# Collision masks for animation frames, keyed by the frame Surface itself.
+# Entries go away together with their frames when a sheet is evicted.
+_frame_masks = weakref.WeakKeyDictionary()
+
+
+def get_mask(surface):
+    """Return the collision mask for a frame, building it only the first time"""
+    mask = _frame_masks.get(surface)
+    if mask is None:
+        mask = pygame.mask.from_surface(surface)
+        _frame_masks[surface] = mask
+    return mask
+
+
+# Bounding boxes of each frame's opaque pixels, relative to the frame's top-left
+_frame_hitboxes = weakref.WeakKeyDictionary()
+
+
+def get_hitbox(surface):
+    """Return the box around a frame's opaque pixels, building it only the first time"""
+    hitbox = _frame_hitboxes.get(surface)
+    if hitbox is None:
+        rects = get_mask(surface).get_bounding_rects()
+        hitbox = rects[0].unionall(rects[1:]) if rects else surface.get_rect()
+        _frame_hitboxes[surface] = hitbox
+    return hitbox
+
+
+# Loaded sprite sheets keyed by (dir1, dir2, width, height, direction).
+# Every Player and Fire shares the same frame lists, so each sheet is only
+# decoded, scaled and flipped once per process.
+_sprite_cache = {}
+_sprite_cache_lock = threading.Lock()
+
+
 def load_sprite_sheets(dir1, dir2, width, height, direction=False):
+    """Return the frames for a sprite folder, loading them on first use"""
+    key = (dir1, dir2, width, height, direction)
+    # Held while loading so a background preload and the game never decode the same sheet twice
+    with _sprite_cache_lock:
+        sprites = _sprite_cache.get(key)
+        if sprites is None:
+            sprites = atlas_sheet(*key)
+            if sprites is None and direction:
+                sprites = _lazy_sprite_sheets(dir1, dir2, width, height)
+            if sprites is None:
+                sprites = _load_sprite_sheets(dir1, dir2, width, height, direction)
+            _sprite_cache[key] = sprites
+    return sprites
+
+
+def preload_sprite_sheets(dir1, dir2, width, height, direction=False):
+    """Start loading a sprite folder into the cache on a background thread"""
+    thread = threading.Thread(target=_preload_sprite_sheets,
+                              args=(dir1, dir2, width, height, direction), daemon=True)
+    thread.start()
+    return thread
+
+
+def _preload_sprite_sheets(dir1, dir2, width, height, direction=False):
+    sprites = load_sprite_sheets(dir1, dir2, width, height, direction)
+    # Lazy sets only list their files, so decode what the game will play right away
+    if isinstance(sprites, LazySprites):
+        sprites.warm(PLAYED_ANIMATIONS)
+
+
+def invalidate_sprite_cache(dir1=None, dir2=None):
+    """Evict cached sprite sheets, either all of them or only one folder.
+
+    Evicting everything also drops the baked atlas and the tiles cut from it,
+    so the next load reads the atlas (or the asset folders) from disk again.
+    """
+    global _atlas
+    # Same lock as loading, so a background preload never races the eviction
+    with _sprite_cache_lock:
+        for key in list(_sprite_cache):
+            if (dir1 is None or key[0] == dir1) and (dir2 is None or key[1] == dir2):
+                del _sprite_cache[key]
+
+    if dir1 is None and dir2 is None:
+        with _atlas_lock:
+            _atlas = None
+            _atlas_frames.clear()
+        _block_cache.clear()
+        Block.TILES.clear()
+        LevelEnd.IMAGES.clear()
+
+
+# Character sprite sheets name their animations differently; these are the names the game asks for
+SPRITE_NAMES = {
+    "Idle": "idle",
+    "Hurt": "hit",
+    "Jump": "jump",
+    "Death": "death",
+    "Run": "run",
+    "Walk": "run"
+}
+
+
+def _load_sprite_sheets(dir1, dir2, width, height, direction=False):
     script_dir = os.path.dirname(os.path.abspath(__file__))
     path = join(script_dir, "assets", dir1, dir2)
 
@@ -39,6 +181,8 @@ def load_sprite_sheets(dir1, dir2, width, height, direction=False):
             all_sprites["on"] = [placeholder]
             all_sprites["idle"] = [placeholder]
 
+        for sprites in all_sprites.values():
+            get_mask(sprites[0])
         return all_sprites
 
     images = [f for f in listdir(path) if isfile(join(path, f)) and f.lower().endswith(('.png', '.jpg', '.jpeg'))]
@@ -46,7 +190,7 @@ def load_sprite_sheets(dir1, dir2, width, height, direction=False):
     all_sprites = {}
 
     for image in images:
-        sprite_sheet = pygame.image.load(join(path, image)).convert_alpha()
+        sprite_sheet = load_image(join(path, image))
 
         sprites = []
         for i in range(sprite_sheet.get_width() // width):
@@ -58,36 +202,385 @@ def load_sprite_sheets(dir1, dir2, width, height, direction=False):
         if direction:
             original_name = image.replace(".png", "").replace(".jpg", "")
 
-            sprite_mapping = {
-                "Idle": "idle",
-                "Hurt": "hit",
-                "Jump": "jump",
-                "Death": "death",
-                "Run": "run",
-                "Walk": "run"
-            }
-
-            name = sprite_mapping.get(original_name, original_name.lower())
+            name = SPRITE_NAMES.get(original_name, original_name.lower())
+            flipped = flip(sprites)
             all_sprites[name + "_right"] = sprites
-            all_sprites[name + "_left"] = flip(sprites)
+            all_sprites[name + "_left"] = flipped
 
             if name == "jump":
                 all_sprites["double_jump_right"] = sprites
-                all_sprites["double_jump_left"] = flip(sprites)
+                all_sprites["double_jump_left"] = flipped
         else:
             all_sprites[image.replace(".png", "").replace(".jpg", "")] = sprites
 
+    # Frames never change after loading, so their masks can be built up front
+    for sprites in all_sprites.values():
+        for sprite in sprites:
+            get_mask(sprite)
+
     return all_sprites
 
 
+# Animations update_sprite can ask for, warmed by preloading a character
+PLAYED_ANIMATIONS = ("idle", "run", "jump", "double_jump", "fall", "hit", "death")
+# Animations (per direction) a lazy sprite set keeps decoded; enough for every played one
+LOADED_ANIMATIONS = 2 * len(PLAYED_ANIMATIONS)
+
+
+class LazySprites(Mapping):
+    """Sprite set that builds each animation the first time it is asked for.
+
+    load(sprites, key) returns the frames for key. Only the most recently used
+    animations stay loaded; aliases map names that share frames to one key.
+    """
+    def __init__(self, keys, load, aliases=None, max_loaded=LOADED_ANIMATIONS):
+        self.names = list(keys)
+        self.name_set = set(self.names)
+        self.load = load
+        self.aliases = aliases or {}
+        self.max_loaded = max_loaded
+        self.loaded = OrderedDict()
+        self.lock = threading.RLock()  # Loading a left sheet loads the right one it flips
+
+    def __getitem__(self, key):
+        if key not in self.name_set:
+            raise KeyError(key)
+        key = self.aliases.get(key, key)
+        frames = self.loaded.get(key)
+        if frames is not None:
+            # Asked for every frame, so the hit path skips the lock
+            try:
+                self.loaded.move_to_end(key)
+            except KeyError:
+                pass  # Evicted by another thread meanwhile; the frames are still valid
+            return frames
+
+        with self.lock:
+            frames = self.loaded.get(key)
+            if frames is None:
+                frames = self.load(self, key)
+                for frame in frames:
+                    get_mask(frame)
+                self.loaded[key] = frames
+                while len(self.loaded) > self.max_loaded:
+                    self.loaded.popitem(last=False)
+        return frames
+
+    def warm(self, names):
+        """Load both directions of the named animations the set has"""
+        for name in names:
+            for key in (name + "_right", name + "_left"):
+                if key in self.name_set:
+                    self[key]
+
+    def __contains__(self, key):
+        return key in self.name_set
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _sheet_files(path, direction=False):
+    """Image file behind each animation name of a sprite folder"""
+    # Same names, and the same file winning a shared name, as loading every sheet up front
+    files = {}
+    for image in listdir(path):
+        if isfile(join(path, image)) and image.lower().endswith(('.png', '.jpg', '.jpeg')):
+            original_name = image.replace(".png", "").replace(".jpg", "")
+            if not direction:
+                files[original_name] = image
+                continue
+            name = SPRITE_NAMES.get(original_name, original_name.lower())
+            files[name] = image
+            if name == "jump":
+                files["double_jump"] = image
+    return files
+
+
+def _cut_frames(sprite_sheet, width, height):
+    """Unscaled width x height frames along a sprite sheet"""
+    frames = []
+    for i in range(sprite_sheet.get_width() // width):
+        surface = pygame.Surface((width, height), pygame.SRCALPHA, 32)
+        surface.blit(sprite_sheet, (0, 0), pygame.Rect(i * width, 0, width, height))
+        frames.append(surface)
+    return frames
+
+
+def _direction_aliases(sources):
+    """LazySprites aliases for animation names whose source (file or rects) an earlier name already has"""
+    canonical = {}
+    aliases = {}
+    for name, source in sources.items():
+        first = canonical.setdefault(source, name)
+        if first != name:
+            aliases[name + "_right"] = first + "_right"
+            aliases[name + "_left"] = first + "_left"
+    return aliases
+
+
+def _directional_sprites(names, load_right, aliases):
+    """LazySprites doubling load_right(name)'s frames and flipping them for the left-facing set"""
+    def load(sprites, key):
+        name, direction = key.rsplit("_", 1)
+        if direction == "left":
+            return flip(sprites[name + "_right"])
+        return [pygame.transform.scale2x(frame) for frame in load_right(name)]
+
+    keys = [name + direction for name in names for direction in ("_right", "_left")]
+    return LazySprites(keys, load, aliases)
+
+
+def _lazy_sprite_sheets(dir1, dir2, width, height):
+    """Character sheets as a LazySprites over the folder's files; None when the folder is missing"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    path = join(script_dir, "assets", dir1, dir2)
+    if not os.path.isdir(path):
+        return None
+
+    files = _sheet_files(path, direction=True)
+    return _directional_sprites(files, lambda name: _cut_frames(load_image(join(path, files[name])), width, height),
+                                _direction_aliases(files))
+
+
+def load_character_thumbnail(asset_dir, width, height):
+    """Load only the first idle frame of a character, scaled for the selection screen"""
+    frame = None
+    atlas = get_atlas()
+    if atlas is not None:
+        idle = atlas[1]["sheets"].get(sheet_key("MainCharacters", asset_dir, 32, 32, True), {}).get("idle")
+        if idle:
+            frame = pygame.transform.scale2x(atlas_frame(idle[0]))
+    if frame is None:
+        frame = _load_thumbnail_frame(asset_dir)
+    if frame is None:
+        return None
+    return pygame.transform.scale(frame, (width, height))
+
+
+def _load_thumbnail_frame(asset_dir):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    path = join(script_dir, "assets", "MainCharacters", asset_dir)
+    if not os.path.isdir(path):
+        return None
+
+    for image in listdir(path):
+        if image.lower() == "idle.png":
+            sprite_sheet = load_image(join(path, image))
+            # Cut and doubled like the game's idle frame, so the thumbnail scales from the same pixels
+            return pygame.transform.scale2x(_cut_frames(sprite_sheet, 32, 32)[0])
+    return None
+
+
+# Scaled terrain tiles keyed by block size, so Terrain.png is decoded once
+_block_cache = {}
+
+
 def get_block(size):
+    block = _block_cache.get(size)
+    if block is None:
+        tile = atlas_image("blocks", str(size))
+        block = pygame.transform.scale2x(tile) if tile is not None else _load_block(size)
+        _block_cache[size] = block
+    return block
+
+
+def _block_tile(size):
+    """Unscaled terrain tile cut from Terrain.png"""
     script_dir = os.path.dirname(os.path.abspath(__file__))
     path = join(script_dir, "assets", "Terrain", "Terrain.png")
-    image = pygame.image.load(path).convert_alpha()
+    image = load_image(path)
     surface = pygame.Surface((size, size), pygame.SRCALPHA, 32)
     rect = pygame.Rect(96, 0, size, size)
     surface.blit(image, (0, 0), rect)
-    return pygame.transform.scale2x(surface)
+    return surface
+
+
+def _load_block(size):
+    return pygame.transform.scale2x(_block_tile(size))
+
+
+# Baked atlas: every frame, tile and background the game loads, already sliced
+# but at source size and facing right, packed into one image with a JSON index
+# of rects. Doubling and flipping happen on load (per animation for characters),
+# which keeps the atlas small enough to store uncompressed. Written by
+# bake_assets.py; without it, or once the asset folders changed since the bake,
+# everything is loaded from the asset folders.
+ATLAS_DIR = join(os.path.dirname(os.path.abspath(__file__)), "assets", ".atlas")
+ATLAS_IMAGE = join(ATLAS_DIR, "atlas.bmp")  # Uncompressed: loads several times faster than a PNG
+ATLAS_INDEX = join(ATLAS_DIR, "atlas.json")
+ATLAS_VERSION = 2
+ATLAS_WIDTH = 2048
+ATLAS_SHEETS = [("Traps", "Fire", 16, 32, False)]  # Characters are added by listing MainCharacters
+ATLAS_BLOCK_SIZES = [96]
+USE_ATLAS = True  # False always loads from the asset folders, e.g. to benchmark them
+
+_atlas = None  # (image, index) once loaded, False when there is no usable atlas
+_atlas_frames = {}  # Subsurfaces by rect, so frames sharing a rect stay one Surface
+_atlas_lock = threading.Lock()
+
+
+def sheet_key(dir1, dir2, width, height, direction=False):
+    """Name of a sprite sheet folder in the atlas index"""
+    return f"{dir1}/{dir2}/{width}x{height}" + ("/directional" if direction else "")
+
+
+def get_atlas():
+    """Return (image, index) of the baked atlas, loading it the first time; None when there is none"""
+    global _atlas
+    with _atlas_lock:
+        if _atlas is None:
+            _atlas = False
+            if USE_ATLAS and os.path.isfile(ATLAS_IMAGE) and os.path.isfile(ATLAS_INDEX):
+                with open(ATLAS_INDEX) as f:
+                    index = json.load(f)
+                if index.get("version") == ATLAS_VERSION and atlas_sources_match(index.get("sources", {})):
+                    _atlas = (load_image(ATLAS_IMAGE), index)
+    return _atlas or None
+
+
+def atlas_sources(characters):
+    """Asset folders and image files the atlas is baked from, relative to assets"""
+    folders = ["MainCharacters", *(join("MainCharacters", name) for name in characters),
+               *(join(dir1, dir2) for dir1, dir2, *_ in ATLAS_SHEETS), "Terrain", "Background"]
+    assets = join(os.path.dirname(os.path.abspath(__file__)), "assets")
+    sources = []
+    for folder in folders:
+        sources.append(folder)
+        sources += [join(folder, name) for name in sorted(listdir(join(assets, folder)))
+                    if name.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    return sources
+
+
+def source_mtimes(sources):
+    assets = join(os.path.dirname(os.path.abspath(__file__)), "assets")
+    return {source: os.stat(join(assets, source)).st_mtime_ns for source in sources}
+
+
+def atlas_sources_match(recorded):
+    """True while no baked-from file was edited or removed and no folder gained or lost a file"""
+    # Folder mtimes change when files are added, removed or renamed in them
+    try:
+        return bool(recorded) and source_mtimes(recorded) == recorded
+    except OSError:
+        return False
+
+
+def atlas_frame(rect):
+    image, _ = get_atlas()
+    rect = tuple(rect)
+    frame = _atlas_frames.get(rect)
+    if frame is None:
+        frame = image.subsurface(pygame.Rect(rect))
+        _atlas_frames[rect] = frame
+    return frame
+
+
+def atlas_image(group, name):
+    """Return one baked image ("blocks" or "backgrounds") at source size, or None"""
+    atlas = get_atlas()
+    if atlas is None or name not in atlas[1][group]:
+        return None
+    return atlas_frame(atlas[1][group][name])
+
+
+def atlas_sheet(dir1, dir2, width, height, direction=False):
+    """Return a sprite sheet's frames from the baked atlas, or None when it was not baked"""
+    atlas = get_atlas()
+    if atlas is None:
+        return None
+    animations = atlas[1]["sheets"].get(sheet_key(dir1, dir2, width, height, direction))
+    if animations is None:
+        return None
+    if direction:
+        # Character sets only double, flip and mask the animations that get played
+        sources = {name: tuple(map(tuple, rects)) for name, rects in animations.items()}
+        return _directional_sprites(animations, lambda name: [atlas_frame(rect) for rect in animations[name]],
+                                    _direction_aliases(sources))
+    all_sprites = {name: [pygame.transform.scale2x(atlas_frame(rect)) for rect in rects]
+                   for name, rects in animations.items()}
+    for sprites in all_sprites.values():
+        for sprite in sprites:
+            get_mask(sprite)
+    return all_sprites
+
+
+def pack_shelves(sizes, width):
+    """Place rects of the given sizes in rows, tallest first; returns positions and the total height"""
+    positions = [None] * len(sizes)
+    x = y = shelf_height = 0
+    for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        w, h = sizes[i]
+        if x + w > width:
+            x, y = 0, y + shelf_height
+            shelf_height = 0
+        positions[i] = (x, y)
+        x += w
+        shelf_height = max(shelf_height, h)
+    return positions, y + shelf_height
+
+
+def bake_atlas(image_path=ATLAS_IMAGE, index_path=ATLAS_INDEX, width=ATLAS_WIDTH):
+    """Cut every sheet, tile and background from the asset folders and write them out as one atlas"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    characters_dir = join(script_dir, "assets", "MainCharacters")
+    backgrounds_dir = join(script_dir, "assets", "Background")
+    characters = sorted(name for name in listdir(characters_dir) if os.path.isdir(join(characters_dir, name)))
+
+    # Unscaled right-facing frames; names sharing a file (jump and double_jump) share its frame list
+    sheets = {}
+    for spec in [("MainCharacters", name, 32, 32, True) for name in characters] + ATLAS_SHEETS:
+        dir1, dir2, frame_width, frame_height, direction = spec
+        path = join(script_dir, "assets", dir1, dir2)
+        files = _sheet_files(path, direction)
+        frames = {image: _cut_frames(load_image(join(path, image)), frame_width, frame_height)
+                  for image in set(files.values())}
+        sheets[sheet_key(*spec)] = {name: frames[image] for name, image in files.items()}
+
+    groups = {
+        "sheets": sheets,
+        "blocks": {str(size): _block_tile(size) for size in ATLAS_BLOCK_SIZES},
+        "backgrounds": {name: pygame.image.load(join(backgrounds_dir, name))
+                        for name in sorted(listdir(backgrounds_dir)) if name.lower().endswith(".png")},
+    }
+
+    # Each distinct Surface is packed once
+    surfaces = {}
+    for animations in groups["sheets"].values():
+        for sprites in animations.values():
+            for sprite in sprites:
+                surfaces[id(sprite)] = sprite
+    for name in ("blocks", "backgrounds"):
+        for surface in groups[name].values():
+            surfaces[id(surface)] = surface
+    surfaces = list(surfaces.values())
+    positions, height = pack_shelves([surface.get_size() for surface in surfaces], width)
+
+    atlas = pygame.Surface((width, height), pygame.SRCALPHA, 32)
+    rects = {}
+    for surface, position in zip(surfaces, positions):
+        # MAX onto the transparent atlas copies pixels exactly instead of alpha blending them
+        atlas.blit(surface, position, special_flags=pygame.BLEND_RGBA_MAX)
+        rects[id(surface)] = [*position, *surface.get_size()]
+
+    index = {"version": ATLAS_VERSION, "width": width, "height": height,
+             "sources": source_mtimes(atlas_sources(characters))}
+    for name, group in groups.items():
+        if name == "sheets":
+            index[name] = {key: {animation: [rects[id(sprite)] for sprite in sprites]
+                                 for animation, sprites in animations.items()}
+                           for key, animations in group.items()}
+        else:
+            index[name] = {key: rects[id(surface)] for key, surface in group.items()}
+
+    os.makedirs(os.path.dirname(image_path), exist_ok=True)
+    pygame.image.save(atlas, image_path)
+    with open(index_path, "w") as f:
+        json.dump(index, f)
+    return index
 
 
 class Player(pygame.sprite.Sprite):
@@ -98,6 +591,7 @@ class Player(pygame.sprite.Sprite):
     def __init__(self, x, y, width, height, character="snowl"):
         super().__init__()
         self.rect = pygame.Rect(x, y, width, height)
+        self.prev_pos = (x, y)  # Position before the last physics tick, for interpolation
         self.x_vel = 0
         self.y_vel = 0
         self.mask = None
@@ -113,6 +607,11 @@ class Player(pygame.sprite.Sprite):
         self.immunity_duration = 120  # 2 seconds at 60 FPS (immunity after taking damage)
         # Load character sprite sheet (placeholder slots allowed)
         self.SPRITES = load_sprite_sheets("MainCharacters", character if character else "missing", 32, 32, True)
+        # One collision box for the whole character: per-frame boxes would move the
+        # feet a few px on every animation frame and sink them into the floor
+        idle = [*self.SPRITES.get("idle_right", []), *self.SPRITES.get("idle_left", [])]
+        boxes = [get_hitbox(frame) for frame in idle]
+        self.body = boxes[0].unionall(boxes[1:]) if boxes else pygame.Rect(0, 0, width, height)
 
     def jump(self):
         # Only allow jump if vertical velocity is reasonable
@@ -147,6 +646,8 @@ class Player(pygame.sprite.Sprite):
             self.animation_count = 0
 
     def loop(self, fps):
+        self.prev_pos = self.rect.topleft
+
         # Apply gravity to player's vertical velocity
         self.y_vel += min(1, (self.fall_count / fps) * self.GRAVITY)
         self.move(self.x_vel, self.y_vel)
@@ -229,19 +730,29 @@ class Player(pygame.sprite.Sprite):
     def update(self):
         # Update collision rectangle and mask for pixel-perfect collision
         self.rect = self.sprite.get_rect(topleft=(self.rect.x, self.rect.y))
-        self.mask = pygame.mask.from_surface(self.sprite)
+        self.mask = get_mask(self.sprite)
+
+    def hitbox(self):
+        # Box around the character's body, in level coordinates
+        return self.body.move(self.rect.topleft)
+
+    def draw(self, win, offset_x, alpha=1.0):
+        # Blend between the last two physics ticks so movement stays smooth at any render rate
+        prev_x, prev_y = self.prev_pos
+        x = round(prev_x + (self.rect.x - prev_x) * alpha)
+        y = round(prev_y + (self.rect.y - prev_y) * alpha)
 
-    def draw(self, win, offset_x):
         # Flicker effect during immunity frames for visual feedback
         if self.immunity_frames <= 0 or (self.immunity_frames // 5) % 2 == 0:
-            win.blit(self.sprite, (self.rect.x - offset_x, self.rect.y))
+            win.blit(self.sprite, (x - offset_x, y))
 
 
 class Object(pygame.sprite.Sprite):
-    def __init__(self, x, y, width, height, name=None):
+    def __init__(self, x, y, width, height, name=None, image=None):
         super().__init__()
         self.rect = pygame.Rect(x, y, width, height)
-        self.image = pygame.Surface((width, height), pygame.SRCALPHA)
+        # Objects sharing a finished image pass it in instead of allocating their own
+        self.image = image if image is not None else pygame.Surface((width, height), pygame.SRCALPHA)
         self.width = width
         self.height = height
         self.name = name
@@ -251,29 +762,52 @@ class Object(pygame.sprite.Sprite):
 
 
 class Block(Object):
+    # Finished tile per block size, shared by every Block of that size
+    TILES = {}
+
     def __init__(self, x, y, size):
-        super().__init__(x, y, size, size)
-        block = get_block(size)
-        self.image.blit(block, (0, 0))
-        self.mask = pygame.mask.from_surface(self.image)
+        tile = self.TILES.get(size)
+        if tile is None:
+            tile = pygame.Surface((size, size), pygame.SRCALPHA)
+            tile.blit(get_block(size), (0, 0))
+            self.TILES[size] = tile
+        super().__init__(x, y, size, size, image=tile)
+        self.mask = get_mask(tile)
+
+
+class TerrainChunk(Object):
+    """Static blocks merged into one surface so a stretch of terrain is a single blit.
+
+    Draw-only: collision keeps using the individual blocks, so no chunk mask is built.
+    """
+    def __init__(self, blocks):
+        rect = blocks[0].rect.unionall([block.rect for block in blocks[1:]])
+        super().__init__(rect.x, rect.y, rect.width, rect.height, "terrain")
+        self.blocks = blocks
+        for block in blocks:
+            self.image.blit(block.image, (block.rect.x - rect.x, block.rect.y - rect.y))
 
 
 class Fire(Object):
     ANIMATION_DELAY = 3
 
     def __init__(self, x, y, width, height):
-        super().__init__(x, y, width, height, "fire")
         self.fire = load_sprite_sheets("Traps", "Fire", width, height)
-        self.image = self.fire["off"][0]
-        self.mask = pygame.mask.from_surface(self.image)
+        super().__init__(x, y, width, height, "fire", self.fire["off"][0])
+        self.mask = get_mask(self.image)
         self.animation_count = 0
         self.animation_name = "off"
+        self.trap_system = None  # Set while a TrapSystem animates this trap
 
     def on(self):
         self.animation_name = "on"
+        if self.trap_system is not None:
+            self.trap_system.refile(self)
 
     def off(self):
         self.animation_name = "off"
+        if self.trap_system is not None:
+            self.trap_system.refile(self)
 
     def loop(self):
         # Animate fire trap
@@ -284,32 +818,208 @@ class Fire(Object):
         self.animation_count += 1
 
         self.rect = self.image.get_rect(topleft=(self.rect.x, self.rect.y))
-        self.mask = pygame.mask.from_surface(self.image)
+        self.mask = get_mask(self.image)
 
         if self.animation_count // self.ANIMATION_DELAY > len(sprites):
             self.animation_count = 0
 
 
+class TrapClock:
+    """Animation clock shared by every trap showing the same frames"""
+    def __init__(self, frames, delay):
+        self.frames = frames
+        self.delay = delay
+        self.count = 0
+        self.traps = []
+
+    def advance(self):
+        # Same frame timing as Fire.loop, worked out once for the whole group
+        image = self.frames[(self.count // self.delay) % len(self.frames)]
+        self.count += 1
+        if self.count // self.delay > len(self.frames):
+            self.count = 0
+        return image
+
+
+class TrapSystem:
+    """Registry of animated traps, advanced together with one clock per animation"""
+    def __init__(self, traps=()):
+        self.clocks = {}
+        self.trap_clocks = {}
+        for trap in traps:
+            self.add(trap)
+
+    def add(self, trap):
+        frames = trap.fire[trap.animation_name]
+        key = (id(frames), trap.ANIMATION_DELAY)
+        clock = self.clocks.get(key)
+        if clock is None:
+            clock = TrapClock(frames, trap.ANIMATION_DELAY)
+            self.clocks[key] = clock
+        clock.traps.append(trap)
+        self.trap_clocks[trap] = clock
+        trap.trap_system = self
+
+    def remove(self, trap):
+        # The clock keeps running without traps, so traps added back later stay in phase
+        clock = self.trap_clocks.pop(trap, None)
+        if clock is not None:
+            clock.traps.remove(trap)
+            trap.trap_system = None
+
+    def refile(self, trap):
+        """Move a trap to the clock of its current animation"""
+        self.remove(trap)
+        self.add(trap)
+
+    def step(self, grid=None):
+        """Advance every trap one tick: one frame lookup and mask per clock, not per trap"""
+        for clock in self.clocks.values():
+            image = clock.advance()
+            if not clock.traps:
+                continue
+            mask = get_mask(image)
+            size = image.get_size()
+            for trap in clock.traps:
+                trap.image = image
+                trap.mask = mask
+                if trap.rect.size != size:
+                    trap.rect.size = size
+                    if grid is not None:
+                        grid.update(trap)
+
+
 class LevelEnd(Object):
     """Flag/door that completes the level when reached"""
+    # Finished flag image per size, shared by every LevelEnd of that size
+    IMAGES = {}
+
     def __init__(self, x, y, width, height):
-        super().__init__(x, y, width, height, "level_end")
-        # Create a simple flag visual indicator
-        self.image.fill((0, 0, 0, 0))
-        # Flag pole (brown)
-        pygame.draw.rect(self.image, (139, 69, 19), (width//2 - 5, 0, 10, height))
-        # Flag (golden)
-        pygame.draw.polygon(self.image, (255, 215, 0), [
-            (width//2 + 5, 10),
-            (width - 10, 30),
-            (width//2 + 5, 50)
-        ])
-        self.mask = pygame.mask.from_surface(self.image)
+        image = self.IMAGES.get((width, height))
+        if image is None:
+            # Create a simple flag visual indicator
+            image = pygame.Surface((width, height), pygame.SRCALPHA)
+            # Flag pole (brown)
+            pygame.draw.rect(image, (139, 69, 19), (width//2 - 5, 0, 10, height))
+            # Flag (golden)
+            pygame.draw.polygon(image, (255, 215, 0), [
+                (width//2 + 5, 10),
+                (width - 10, 30),
+                (width//2 + 5, 50)
+            ])
+            self.IMAGES[(width, height)] = image
+        super().__init__(x, y, width, height, "level_end", image)
+        self.mask = get_mask(image)
+
+
+class SpatialGrid:
+    """Uniform grid over level objects so collision checks only visit nearby ones"""
+
+    def __init__(self, objects=(), cell_size=96):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.object_cells = {}
+        self.order = {}
+        self.next_index = 0
+        self.candidates = 0  # Running total of objects returned by query, for profiling
+        for obj in objects:
+            self.insert(obj)
+
+    def _bounds(self, rect):
+        # Range of cells (inclusive) covered by a rect
+        size = self.cell_size
+        return (rect.left // size, rect.top // size,
+                (rect.right - 1) // size, (rect.bottom - 1) // size)
+
+    def _keys(self, bounds):
+        left, top, right, bottom = bounds
+        for cx in range(left, right + 1):
+            for cy in range(top, bottom + 1):
+                yield cx, cy
+
+    def insert(self, obj):
+        """Add an object to the grid at its current rect"""
+        if obj in self.order:
+            self.update(obj)
+            return
+        # Remember insertion order so queries return objects in level order
+        self.order[obj] = self.next_index
+        self.next_index += 1
+        bounds = self._bounds(obj.rect)
+        self.object_cells[obj] = bounds
+        for key in self._keys(bounds):
+            self.cells.setdefault(key, []).append(obj)
+
+    def remove(self, obj):
+        """Take an object out of the grid"""
+        bounds = self.object_cells.pop(obj, None)
+        if bounds is None:
+            return
+        del self.order[obj]
+        self._unlink(obj, bounds)
+
+    def _unlink(self, obj, bounds):
+        for key in self._keys(bounds):
+            cell = self.cells[key]
+            cell.remove(obj)
+            if not cell:
+                del self.cells[key]
+
+    def update(self, obj):
+        """Re-file an object whose rect moved or changed size"""
+        bounds = self._bounds(obj.rect)
+        old_bounds = self.object_cells.get(obj)
+        if bounds == old_bounds:
+            return
+        if old_bounds is None:
+            self.insert(obj)
+            return
+        self._unlink(obj, old_bounds)
+        self.object_cells[obj] = bounds
+        for key in self._keys(bounds):
+            self.cells.setdefault(key, []).append(obj)
+
+    def query(self, rect):
+        """Return objects whose cells overlap rect, in the order they were added"""
+        found = set()
+        for key in self._keys(self._bounds(rect)):
+            cell = self.cells.get(key)
+            if cell:
+                found.update(cell)
+        self.candidates += len(found)
+        return sorted(found, key=self.order.__getitem__)
+
+
+class CameraIndex:
+    """Level objects sorted by x so drawing only visits what the camera can see"""
+
+    def __init__(self, objects):
+        self.rebuild(objects)
+
+    def rebuild(self, objects):
+        """Re-sort after objects were added, removed or moved"""
+        entries = sorted(((obj.rect.left, i, obj) for i, obj in enumerate(objects)),
+                         key=lambda entry: (entry[0], entry[1]))
+        self.lefts = [left for left, _, _ in entries]
+        self.entries = [(i, obj) for _, i, obj in entries]
+        # Widest object bounds how far left of the view a visible object can start
+        self.max_width = max((obj.rect.width for obj in objects), default=0)
+
+    def visible(self, offset_x, width=WIDTH):
+        """Return objects overlapping [offset_x, offset_x + width], in level order"""
+        # Fire traps can grow once they start animating, so allow a block of slack
+        start = bisect.bisect_right(self.lefts, offset_x - max(self.max_width, 96))
+        end = bisect.bisect_left(self.lefts, offset_x + width)
+        found = [(i, obj) for i, obj in self.entries[start:end] if obj.rect.right > offset_x]
+        found.sort(key=lambda entry: entry[0])
+        return [obj for _, obj in found]
 
 
 def get_background(name):
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    image = pygame.image.load(join(script_dir, "assets", "Background", name))
+    image = atlas_image("backgrounds", name)
+    if image is None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        image = pygame.image.load(join(script_dir, "assets", "Background", name))
     _, _, width, height = image.get_rect()
     tiles = []
 
@@ -322,6 +1032,40 @@ def get_background(name):
     return tiles, image
 
 
+class Background:
+    """Tiled background composed once into a single surface"""
+    def __init__(self, name, scroll=False):
+        tiles, image = get_background(name)
+        self.tile_width = image.get_width()
+        self.scroll = scroll
+
+        # One extra tile column so the surface can slide left when scrolling
+        self.image = pygame.Surface((WIDTH + self.tile_width, HEIGHT))
+        for x, y in tiles:
+            self.image.blit(image, (x, y))
+            self.image.blit(image, (x + self.tile_width, y))
+        if pygame.display.get_surface():
+            self.image = self.image.convert()
+
+    def draw(self, win, offset_x):
+        x = -(offset_x % self.tile_width) if self.scroll else 0
+        win.blit(self.image, (x, 0))
+
+
+# Fonts keyed by size; creating a Font opens and parses the font file
+_fonts = {}
+
+
+def get_font(size):
+    font = _fonts.get(size)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = pygame.font.Font(None, size)
+        _fonts[size] = font
+    return font
+
+
 def draw_hearts(window, player):
     """Draw heart UI for player health display"""
     heart_size = 30
@@ -349,42 +1093,274 @@ def draw_hearts(window, player):
 
 def draw_level_indicator(window, current_level):
     """Draw current level number on screen"""
-    font = pygame.font.Font(None, 36)
+    font = get_font(36)
     text = font.render(f"Level {current_level}", True, (255, 255, 255))
     text_rect = text.get_rect(topright=(WIDTH - 20, 20))
 
     # Draw black outline for better visibility
-    outline_color = (0, 0, 0)
+    outline_text = font.render(f"Level {current_level}", True, (0, 0, 0))
     for dx, dy in [(-2, -2), (-2, 2), (2, -2), (2, 2)]:
-        outline_text = font.render(f"Level {current_level}", True, outline_color)
         window.blit(outline_text, (text_rect.x + dx, text_rect.y + dy))
 
     window.blit(text, text_rect)
 
 
-def draw(window, background, bg_image, player, objects, offset_x, current_level):
-    # Draw tiled background
-    for tile in background:
-        window.blit(bg_image, tile)
+class Hud:
+    """Hearts and level indicator, re-rendered only when health or level changes"""
+    def __init__(self):
+        self.hearts = None
+        self.hearts_key = None
+        self.level = None
+        self.level_key = None
+
+    def draw(self, window, player, current_level):
+        hearts_key = (player.health, player.max_health)
+        if hearts_key != self.hearts_key:
+            # Same layout as draw_hearts: 10px padding, 30px hearts 5px apart
+            self.hearts = pygame.Surface((10 + player.max_health * 35, 41), pygame.SRCALPHA)
+            draw_hearts(self.hearts, player)
+            self.hearts_key = hearts_key
+
+        if current_level != self.level_key:
+            # Text and outline stay separate surfaces so anti-aliased edges
+            # blend with the scene exactly like draw_level_indicator
+            font = get_font(36)
+            text = font.render(f"Level {current_level}", True, (255, 255, 255))
+            outline = font.render(f"Level {current_level}", True, (0, 0, 0))
+            self.level = (text, outline, text.get_rect(topright=(WIDTH - 20, 20)))
+            self.level_key = current_level
+
+        window.blit(self.hearts, (0, 0))
+        text, outline, text_rect = self.level
+        for dx, dy in [(-2, -2), (-2, 2), (2, -2), (2, 2)]:
+            window.blit(outline, (text_rect.x + dx, text_rect.y + dy))
+        window.blit(text, text_rect)
 
-    # Draw all game objects
+
+class DirtyRects:
+    """Pushes only the changed parts of the window to the display"""
+    def __init__(self):
+        self.previous = []
+        self.last_offset_x = None
+        self.last_hud = None
+
+    def update(self, player, objects, offset_x, current_level, overlay=None):
+        # Anything scrolls with the camera, and HUD changes are rare, so push the whole frame
+        hud = (player.health, player.max_health, current_level)
+        if offset_x != self.last_offset_x or hud != self.last_hud:
+            self.previous = []
+            self.last_offset_x = offset_x
+            self.last_hud = hud
+            pygame.display.update()
+            return
+
+        # Player (anywhere between its last two ticks) and animated traps, plus
+        # where they were last frame so old pixels get cleared
+        rects = [player.rect.union(player.rect.move(player.prev_pos[0] - player.rect.x,
+                                                    player.prev_pos[1] - player.rect.y)).move(-offset_x, 0)]
+        rects += [obj.rect.move(-offset_x, 0) for obj in objects if isinstance(obj, Fire)]
+        if overlay is not None:
+            rects.append(overlay)  # Screen-space already, e.g. the profiler overlay
+        pygame.display.update(self.previous + rects)
+        self.previous = rects
+
+
+class FrameProfiler:
+    """Per-frame timings of the main loop phases, with an optional overlay and CSV/JSON export"""
+    FIELDS = ("frame", "time_ms", "frame_ms", "ticks", "player", "traps", "collision", "draw", "candidates")
+    OVERLAY_POS = (10, 60)
+
+    def __init__(self, show_overlay=True, window_frames=300, keep_all=False):
+        self.show_overlay = show_overlay
+        self.window_frames = window_frames  # Recent frames the overlay statistics cover
+        self.recent = deque(maxlen=window_frames)
+        self.samples = [] if keep_all else None  # Every frame, only kept when they are exported
+        self.frames = 0
+        self.current = {}
+        self.start_time = time.perf_counter()
+        self.last_frame = self.start_time
+        self.overlay = None
+        self.overlay_time = 0
+
+    @contextmanager
+    def section(self, name):
+        """Add the time spent in the with-block to this frame's total for name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, value):
+        self.current[name] = self.current.get(name, 0) + value
+
+    def restart(self):
+        """Start timing the next frame from now, so menus and loading are not counted as a frame"""
+        self.current = {}
+        self.last_frame = time.perf_counter()
+
+    def end_frame(self):
+        """Close the current frame and start collecting the next one"""
+        now = time.perf_counter()
+        sample = {field: 0 for field in self.FIELDS}
+        sample.update(self.current)
+        sample["frame"] = self.frames
+        sample["time_ms"] = (now - self.start_time) * 1000
+        sample["frame_ms"] = (now - self.last_frame) * 1000
+        self.frames += 1
+        self.recent.append(sample)
+        if self.samples is not None:
+            self.samples.append(sample)
+        self.current = {}
+        self.last_frame = now
+
+    def summary(self, samples=None):
+        """Average section times and frame time percentiles, over every kept frame by default"""
+        if samples is None:
+            samples = self.samples if self.samples is not None else self.recent
+        if not samples:
+            return {}
+        frame_times = sorted(sample["frame_ms"] for sample in samples)
+
+        def percentile(p):
+            return frame_times[min(len(frame_times) - 1, int(len(frame_times) * p / 100))]
+
+        result = {"frames": len(samples), "fps": 1000 * len(samples) / max(sum(frame_times), 1e-9),
+                  "p50_ms": percentile(50), "p95_ms": percentile(95), "p99_ms": percentile(99)}
+        for name in ("player", "traps", "collision", "draw", "candidates"):
+            result[name] = sum(sample[name] for sample in samples) / len(samples)
+        return result
+
+    def draw_overlay(self, window):
+        if not self.show_overlay:
+            return
+        # Re-render a few times a second; the text itself is not free
+        now = time.perf_counter()
+        if self.overlay is None or now - self.overlay_time > 0.25:
+            stats = self.summary(self.recent)
+            lines = [f"FPS {stats.get('fps', 0):.0f}",
+                     f"frame p50 {stats.get('p50_ms', 0):.1f}  p95 {stats.get('p95_ms', 0):.1f}"
+                     f"  p99 {stats.get('p99_ms', 0):.1f} ms"]
+            lines += [f"{name} {stats.get(name, 0):.2f} ms" for name in ("player", "traps", "collision", "draw")]
+            lines.append(f"candidates {stats.get('candidates', 0):.1f}")
+            font = get_font(24)
+            rendered = [font.render(line, True, (255, 255, 255)) for line in lines]
+            self.overlay = pygame.Surface((max(text.get_width() for text in rendered) + 10, 20 * len(lines) + 10),
+                                          pygame.SRCALPHA)
+            self.overlay.fill((0, 0, 0, 160))
+            for i, text in enumerate(rendered):
+                self.overlay.blit(text, (5, 5 + i * 20))
+            self.overlay_time = now
+        window.blit(self.overlay, self.OVERLAY_POS)
+
+    def overlay_rect(self):
+        """Screen area the overlay covers, or None while it is hidden"""
+        if not self.show_overlay or self.overlay is None:
+            return None
+        return self.overlay.get_rect(topleft=self.OVERLAY_POS)
+
+    def export(self, path):
+        """Write the kept frame samples to a .csv file, or to JSON with a summary for any other extension"""
+        samples = list(self.samples if self.samples is not None else self.recent)
+        if path.lower().endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+                writer.writeheader()
+                writer.writerows(samples)
+        else:
+            with open(path, "w") as f:
+                json.dump({"summary": self.summary(samples), "samples": samples}, f)
+
+
+def draw(window, background, player, objects, offset_x, current_level, camera=None, hud=None, dirty=None,
+         alpha=1.0, profiler=None):
+    # Draw the pre-composed background in a single blit
+    background.draw(window, offset_x)
+
+    # Draw game objects, only the ones on screen when a camera index is available
+    if camera is not None:
+        objects = camera.visible(offset_x)
     for obj in objects:
         obj.draw(window, offset_x)
 
     # Draw player
-    player.draw(window, offset_x)
-
-    # Draw UI elements
-    draw_hearts(window, player)
-    draw_level_indicator(window, current_level)
-
-    pygame.display.update()
+    player.draw(window, offset_x, alpha)
+
+    # Draw UI elements, from cached surfaces when a HUD is available
+    if hud is not None:
+        hud.draw(window, player, current_level)
+    else:
+        draw_hearts(window, player)
+        draw_level_indicator(window, current_level)
+
+    if profiler is not None:
+        profiler.draw_overlay(window)
+
+    if dirty is not None:
+        dirty.update(player, objects, offset_x, current_level,
+                     profiler.overlay_rect() if profiler is not None else None)
+    else:
+        pygame.display.update()
 
 
-def handle_vertical_collision(player, objects, dy):
+def nearby_objects(player, objects, grid=None):
+    """Narrow objects down to the ones around the player when a grid is available"""
+    if grid is None:
+        return objects
+    # Cover the whole move since the last tick plus the horizontal probes
+    prev_x, prev_y = player.prev_pos
+    swept = player.rect.union(player.rect.move(prev_x - player.rect.x, prev_y - player.rect.y))
+    return grid.query(swept.inflate(PLAYER_VEL * 4, 0))
+
+
+def sweep_vertical(player, blocks):
+    """Find the first block the player's box touches on its vertical move since the last tick.
+
+    A block the box already overlapped before the move counts too, so the player
+    is pushed back out of it instead of sinking through.
+    """
+    box = player.hitbox()
+    dy = player.rect.y - player.prev_pos[1]
+    start = box.move(0, -dy)
+    contact = None
+    for obj in blocks:
+        rect = obj.rect
+        if rect.left >= box.right or rect.right <= box.left:
+            continue
+        if dy >= 0 and start.top < rect.top < box.bottom:
+            # Falling: the highest top edge crossed (or already below the head) is reached first
+            if contact is None or rect.top < contact.rect.top:
+                contact = obj
+        elif dy < 0 and box.top < rect.bottom < start.bottom:
+            # Rising: the lowest bottom edge crossed is reached first
+            if contact is None or rect.bottom > contact.rect.bottom:
+                contact = obj
+    return contact, box
+
+
+def handle_vertical_collision(player, objects, dy, grid=None):
     """Handle collisions when player moves vertically"""
     collided_objects = []
-    for obj in objects:
+    candidates = nearby_objects(player, objects, grid)
+
+    # Blocks are solid rectangles: stop the box where it first touched one, so
+    # fast falls cannot pass through a block between two ticks
+    contact, box = sweep_vertical(player, [obj for obj in candidates if isinstance(obj, Block)])
+    if contact is not None:
+        if player.rect.y >= player.prev_pos[1]:
+            # Landing on top of object
+            player.rect.y += contact.rect.top - box.bottom
+            player.landed()
+        else:
+            # Hitting head on bottom of object
+            player.rect.y += contact.rect.bottom - box.top
+            player.hit_head()
+        collided_objects.append(contact)
+
+    # Traps and the flag are not rectangular, so they keep the pixel-perfect test
+    for obj in candidates:
+        if isinstance(obj, Block):
+            continue
         if pygame.sprite.collide_mask(player, obj):
             if dy > 0:
                 # Landing on top of object
@@ -400,25 +1376,30 @@ def handle_vertical_collision(player, objects, dy):
     return collided_objects
 
 
-def collide(player, objects, dx):
+def collide(player, objects, dx, grid=None):
     """Check for horizontal collision without actually moving player"""
-    player.move(dx, 0)
-    player.update()
-    collided_object = None
-    for obj in objects:
-        if pygame.sprite.collide_mask(player, obj):
-            collided_object = obj
-            break
-
-    # Undo the test movement
-    player.move(-dx, 0)
-    player.update()
-    return collided_object
+    box = player.hitbox()
+    probe = box.move(dx, 0)
+    for obj in nearby_objects(player, objects, grid):
+        if isinstance(obj, Block):
+            # Only walls on the side we are probing count
+            if probe.colliderect(obj.rect) and (obj.rect.centerx < box.centerx) == (dx < 0):
+                return obj
+        elif obj.mask.overlap(player.mask, (player.rect.x + dx - obj.rect.x, player.rect.y - obj.rect.y)):
+            return obj
+    return None
+
+
+def handle_move(player, objects, grid=None, keys=None):
+    """Handle player movement and collision detection"""
+    if keys is None:
+        keys = pygame.key.get_pressed()
 
+    # One broadphase query covers the vertical sweep and both side probes
+    objects = nearby_objects(player, objects, grid)
 
-def handle_move(player, objects):
-    """Handle player movement and collision detection"""
-    keys = pygame.key.get_pressed()
+    # Settle vertically first so standing on the floor never reads as a wall
+    vertical_collide = handle_vertical_collision(player, objects, player.y_vel)
 
     player.x_vel = 0
     collide_left = collide(player, objects, -PLAYER_VEL * 2)
@@ -430,8 +1411,6 @@ def handle_move(player, objects):
     if keys[pygame.K_RIGHT] and not collide_right:
         player.move_right(PLAYER_VEL)
 
-    vertical_collide = handle_vertical_collision(player, objects, player.y_vel)
-
     # Check for level completion by touching the flag
     for obj in vertical_collide + [collide_left, collide_right]:
         if obj and obj.name == "level_end":
@@ -462,6 +1441,21 @@ def place_flag_on_platform(objects, desired_x, flag_w, flag_h, default_y):
     return LevelEnd(desired_x, default_y, flag_w, flag_h)
 
 
+def bake_terrain(objects, chunk_width=WIDTH):
+    """Return a draw list where Blocks are merged into one TerrainChunk per chunk_width"""
+    chunks = {}
+    others = []
+    for obj in objects:
+        if isinstance(obj, Block):
+            chunks.setdefault(obj.rect.left // chunk_width, []).append(obj)
+        else:
+            others.append(obj)
+
+    # Terrain goes first so traps and the flag are drawn on top of it
+    baked = [TerrainChunk(blocks) for _, blocks in sorted(chunks.items())]
+    return baked + others
+
+
 def create_level_1():
     """Create level 1 layout - Tutorial/Easy level with basic platforming"""
     block_size = 96
@@ -718,171 +1712,643 @@ def create_level_5():
     return objects
 
 
-def show_game_over(window):
-    """Display game over screen with fade-in effect"""
-    # Create semi-transparent overlay for smooth transition
-    overlay = pygame.Surface((WIDTH, HEIGHT))
-    overlay.fill((0, 0, 0))
+LEVEL_BUILDERS = [create_level_1, create_level_2, create_level_3, create_level_4, create_level_5]
+
+
+# Level files: a tile grid ('#' block, '.' empty, bottom row sits on the
+# bottom of the screen) followed by one "kind x y width height" line per entity.
+# Each file is compiled once into a packed binary cache next to it.
+LEVEL_DIR = join(os.path.dirname(os.path.abspath(__file__)), "levels")
+LEVEL_CACHE_DIR = join(LEVEL_DIR, ".cache")
+LEVEL_MAGIC = b"PLVL"
+LEVEL_VERSION = 1
+LEVEL_HEADER = struct.Struct("<4sHqiiiiI")  # magic, version, source mtime, block size, origin, cols, rows, entities
+LEVEL_ENTITY = struct.Struct("<Biiii")  # kind, x, y, width, height
+ENTITY_KINDS = {"fire": 1, "flag": 2}
+
+# Open compiled levels keyed by source path, with the source mtime they were built from
+_compiled_levels = {}
+
+
+def level_path(level):
+    return join(LEVEL_DIR, f"level_{level}.txt")
+
+
+def level_count():
+    """Number of playable levels, from level files or the built-in builders"""
+    count = len(LEVEL_BUILDERS)
+    while os.path.isfile(level_path(count + 1)):
+        count += 1
+    return count
+
+
+def build_level(level):
+    """Create a level's objects, preferring its level file over the built-in builder"""
+    path = level_path(level)
+    if os.path.isfile(path):
+        return load_level(path)
+    return LEVEL_BUILDERS[level - 1]()
+
+
+def parse_level(text):
+    """Read a level file into (block_size, origin column, tile rows, entities)"""
+    block_size, origin = 96, 0
+    rows = []
+    entities = []
+    in_tiles = False
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or (line.startswith("#") and not in_tiles):
+            continue
+        parts = line.split()
+        if parts[0] == "tiles":
+            # tiles <origin column> <block size>
+            origin, block_size = int(parts[1]), int(parts[2])
+            in_tiles = True
+        elif parts[0] == "end":
+            in_tiles = False
+        elif in_tiles:
+            rows.append(line)
+        elif parts[0] in ENTITY_KINDS:
+            entities.append((parts[0], *(int(value) for value in parts[1:5])))
+        else:
+            raise ValueError(f"Unknown level entry: {line}")
+    return block_size, origin, rows, entities
+
+
+def compile_level(path):
+    """Pack a level file into header, tile bytes and entity records"""
+    with open(path) as f:
+        block_size, origin, rows, entities = parse_level(f.read())
+
+    cols = max((len(row) for row in rows), default=0)
+    tiles = bytearray(cols * len(rows))
+    for r, row in enumerate(rows):
+        for c, char in enumerate(row):
+            if char == "#":
+                tiles[r * cols + c] = 1
+
+    data = bytearray(LEVEL_HEADER.pack(LEVEL_MAGIC, LEVEL_VERSION, os.stat(path).st_mtime_ns,
+                                       block_size, origin, cols, len(rows), len(entities)))
+    data += tiles
+    for kind, x, y, width, height in entities:
+        data += LEVEL_ENTITY.pack(ENTITY_KINDS[kind], x, y, width, height)
+    return bytes(data)
+
+
+def open_compiled_level(path):
+    """Return the compiled form of a level file, memory-mapping the cache when it is current"""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _compiled_levels.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    cache_path = join(LEVEL_CACHE_DIR, os.path.basename(path) + ".bin")
+    data = None
+    try:
+        with open(cache_path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, source_mtime = LEVEL_HEADER.unpack_from(mapped)[:3]
+        if (magic, version, source_mtime) == (LEVEL_MAGIC, LEVEL_VERSION, mtime):
+            data = mapped
+        else:
+            mapped.close()
+    except (OSError, ValueError, struct.error):
+        pass
+
+    if data is None:
+        # Missing or stale cache: compile and try to store it for the next launch
+        data = compile_level(path)
+        try:
+            os.makedirs(LEVEL_CACHE_DIR, exist_ok=True)
+            temp_path = cache_path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass
+
+    if cached and isinstance(cached[1], mmap.mmap):
+        cached[1].close()
+    _compiled_levels[path] = (mtime, data)
+    return data
+
+
+def load_level_specs(path):
+    """Read a level file as (kind, x, y, width, height) tuples without creating any objects"""
+    data = open_compiled_level(path)
+    _, _, _, block_size, origin, cols, rows, entity_count = LEVEL_HEADER.unpack_from(data)
+    tiles = memoryview(data)[LEVEL_HEADER.size:LEVEL_HEADER.size + cols * rows]
+
+    specs = []
+    for r in range(rows):
+        y = HEIGHT - block_size * (rows - r)
+        row = tiles[r * cols:(r + 1) * cols]
+        for c in range(cols):
+            if row[c]:
+                specs.append(("block", (origin + c) * block_size, y, block_size, block_size))
+    tiles.release()
+
+    kind_names = {value: name for name, value in ENTITY_KINDS.items()}
+    offset = LEVEL_HEADER.size + cols * rows
+    for _ in range(entity_count):
+        kind, x, y, width, height = LEVEL_ENTITY.unpack_from(data, offset)
+        offset += LEVEL_ENTITY.size
+        specs.append((kind_names[kind], x, y, width, height))
+    return specs
+
+
+def object_spec(obj):
+    """Describe a level object as a (kind, x, y, width, height) tuple"""
+    if isinstance(obj, Block):
+        return ("block", obj.rect.x, obj.rect.y, obj.width, obj.height)
+    if isinstance(obj, Fire):
+        return ("fire", obj.rect.x, obj.rect.y, obj.width, obj.height)
+    return ("flag", obj.rect.x, obj.rect.y, obj.width, obj.height)
+
+
+def create_object(spec):
+    """Create the level object described by a spec tuple"""
+    kind, x, y, width, height = spec
+    if kind == "block":
+        return Block(x, y, width)
+    if kind == "fire":
+        fire = Fire(x, y, width, height)
+        fire.on()
+        return fire
+    return LevelEnd(x, y, width, height)
+
+
+def load_level(path):
+    """Create the objects of a level file"""
+    return [create_object(spec) for spec in load_level_specs(path)]
+
+
+def build_level_specs(level):
+    """Describe a level's objects as spec tuples, for streaming it in chunks"""
+    path = level_path(level)
+    if os.path.isfile(path):
+        return load_level_specs(path)
+    return [object_spec(obj) for obj in LEVEL_BUILDERS[level - 1]()]
+
+
+class EntityStore:
+    """Level entities kept as parallel array columns, sorted by x, instead of one Sprite each.
+
+    Objects are only created for the rows a ChunkedLevel needs; their surfaces
+    and masks are the shared per-kind ones, so a row costs a few bytes. Trap
+    animation is shared per animation by the level's TrapSystem.
+    """
+    KINDS = ("block", "fire", "flag")
+
+    def __init__(self, specs):
+        specs = sorted(specs, key=lambda spec: spec[1])
+        self.kind = array("B", [self.KINDS.index(spec[0]) for spec in specs])
+        self.x = array("i", [spec[1] for spec in specs])
+        self.y = array("i", [spec[2] for spec in specs])
+        self.width = array("i", [spec[3] for spec in specs])
+        self.height = array("i", [spec[4] for spec in specs])
+
+    def __len__(self):
+        return len(self.kind)
+
+    def spec(self, row):
+        return (self.KINDS[self.kind[row]], self.x[row], self.y[row], self.width[row], self.height[row])
+
+    def create(self, row):
+        """Create the object for a row"""
+        return create_object(self.spec(row))
+
+    def create_between(self, left, right):
+        """Create objects for every row whose left edge is in [left, right)"""
+        start = bisect.bisect_left(self.x, left)
+        end = bisect.bisect_left(self.x, right)
+        return [self.create(row) for row in range(start, end)]
+
+
+class ChunkedLevel:
+    """Level that only keeps objects alive for the chunks around the camera"""
+    def __init__(self, source, chunk_width=WIDTH, view_distance=1, store=None):
+        # source(chunk_index) creates every object whose left edge is in that chunk
+        self.source = source
+        self.chunk_width = chunk_width
+        self.view_distance = view_distance
+        self.store = store
+        self.chunks = {}
+        self.objects = []
+        self.drawables = []
+        self.grid = SpatialGrid()
+        self.camera = CameraIndex([])
+        self.traps = TrapSystem()
+
+    @classmethod
+    def from_specs(cls, specs, chunk_width=WIDTH, view_distance=1):
+        """Stream a finite level given as spec tuples, stored compactly in an EntityStore"""
+        store = EntityStore(specs)
+
+        def source(index):
+            return store.create_between(index * chunk_width, (index + 1) * chunk_width)
+        return cls(source, chunk_width, view_distance, store)
+
+    def update(self, offset_x):
+        """Create chunks coming into view and drop the ones far behind or ahead of the camera"""
+        first = offset_x // self.chunk_width - self.view_distance
+        last = (offset_x + WIDTH) // self.chunk_width + self.view_distance
+
+        changed = False
+        for index in range(first, last + 1):
+            if index not in self.chunks:
+                self._load(index)
+                changed = True
+        # One chunk of slack so walking back and forth over a boundary does not thrash
+        for index in list(self.chunks):
+            if index < first - 1 or index > last + 1:
+                self._evict(index)
+                changed = True
+
+        if changed:
+            self.objects = [obj for index in sorted(self.chunks) for obj in self.chunks[index][0]]
+            # Terrain first so traps and the flag are drawn on top of it
+            terrain = [drawable for index in sorted(self.chunks) for drawable in self.chunks[index][1]]
+            self.drawables = terrain + [obj for obj in self.objects if not isinstance(obj, Block)]
+            self.camera.rebuild(self.drawables)
+
+    def _load(self, index):
+        objects = self.source(index)
+        for obj in objects:
+            self.grid.insert(obj)
+            if isinstance(obj, Fire):
+                self.traps.add(obj)
+        blocks = [obj for obj in objects if isinstance(obj, Block)]
+        terrain = [TerrainChunk(blocks)] if blocks else []
+        self.chunks[index] = (objects, terrain)
+
+    def _evict(self, index):
+        objects, _ = self.chunks.pop(index)
+        for obj in objects:
+            self.grid.remove(obj)
+            if isinstance(obj, Fire):
+                self.traps.remove(obj)
+
+
+def save_level(objects, path, block_size=96):
+    """Write level objects out in the level file format"""
+    blocks = {(obj.rect.x // block_size, (HEIGHT - obj.rect.y) // block_size)
+              for obj in objects if isinstance(obj, Block)}
+    origin = min(col for col, _ in blocks)
+    cols = max(col for col, _ in blocks) - origin + 1
+    rows = max(row for _, row in blocks)
+
+    lines = [f"tiles {origin} {block_size}"]
+    for row in range(rows, 0, -1):
+        lines.append("".join("#" if (origin + c, row) in blocks else "." for c in range(cols)))
+    lines.append("end")
+    for obj in objects:
+        if isinstance(obj, Fire):
+            lines.append(f"fire {obj.rect.x} {obj.rect.y} {obj.width} {obj.height}")
+        elif isinstance(obj, LevelEnd):
+            lines.append(f"flag {obj.rect.x} {obj.rect.y} {obj.width} {obj.height}")
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+class LevelPreloader:
+    """Builds a level's first chunks on a background thread while a menu or transition is showing"""
+    def __init__(self, level):
+        self.level = level
+        self.world = None
+        self.error = None
+        self.thread = threading.Thread(target=self._build, daemon=True)
+        self.thread.start()
+
+    def _build(self):
+        try:
+            world = ChunkedLevel.from_specs(build_level_specs(self.level))
+            world.update(0)
+            self.world = world
+        except Exception as error:
+            self.error = error
+
+    def result(self):
+        """Wait for the level if it is still being built and hand it over"""
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.world
+
+
+def preload_level(level):
+    """Start building a level in the background, or return None past the last level"""
+    if level > level_count():
+        return None
+    return LevelPreloader(level)
+
+
+# Input bits for scripted play, one bitmask per frame
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4
+
+
+class ScriptedKeys:
+    """Stands in for pygame.key.get_pressed() using an input bitmask"""
+    def __init__(self, bits):
+        self.bits = bits
+
+    def __getitem__(self, key):
+        if key == pygame.K_LEFT:
+            return bool(self.bits & INPUT_LEFT)
+        if key == pygame.K_RIGHT:
+            return bool(self.bits & INPUT_RIGHT)
+        return False
+
+
+def read_input(jump=False):
+    """Current keyboard state as an input bitmask; jump is a SPACE press seen since the last tick"""
+    pressed = pygame.key.get_pressed()
+    bits = INPUT_JUMP if jump else 0
+    if pressed[pygame.K_LEFT]:
+        bits |= INPUT_LEFT
+    if pressed[pygame.K_RIGHT]:
+        bits |= INPUT_RIGHT
+    return bits
+
+
+def step_input(player, objects, grid, bits, traps=None, profiler=None):
+    """Advance level physics by one frame driven by an input bitmask; returns True when the level is completed"""
+    # Jump on the frame the bit is set (same as a KEYDOWN event)
+    if bits & INPUT_JUMP and player.jump_count < 2:
+        player.jump()
+    return step_level(player, objects, grid, ScriptedKeys(bits), traps, profiler)
+
+
+def step_level(player, objects, grid, keys=None, traps=None, profiler=None):
+    """Advance level physics by one frame; returns True when the level is completed"""
+    section = profiler.section if profiler is not None else nullcontext
+
+    # Update player physics
+    with section("player"):
+        player.loop(FPS)
+
+    # Update all animated objects (fire traps), in one batch when they are registered
+    with section("traps"):
+        if traps is not None:
+            traps.step(grid)
+        else:
+            for obj in objects:
+                if isinstance(obj, Fire):
+                    obj.loop()
+                    grid.update(obj)
+
+    # Handle player movement and check for level completion
+    candidates = grid.candidates
+    with section("collision"):
+        level_completed = handle_move(player, objects, grid, keys)
+    if profiler is not None:
+        profiler.add("candidates", grid.candidates - candidates)
+        profiler.add("ticks", 1)
+
+    # Check if player fell off the map (instant death)
+    if player.rect.y > HEIGHT:
+        player.health = 0
+
+    return level_completed
+
+
+def play_inputs(level, inputs, character="snowl", max_frames=None):
+    """Play a level without rendering or frame limiting; returns (outcome, frames, player)"""
+    objects = build_level(level)
+    grid = SpatialGrid(objects)
+    traps = TrapSystem(obj for obj in objects if isinstance(obj, Fire))
+    player = Player(100, 100, 50, 50, character=character)
+
+    outcome = "timeout"
+    frames = 0
+    for bits in inputs:
+        if max_frames is not None and frames >= max_frames:
+            break
+        frames += 1
 
-    # Fade in effect
-    for alpha in range(0, 200, 10):
-        overlay.set_alpha(alpha)
-        window.blit(overlay, (0, 0))
-        pygame.display.update()
-        pygame.time.delay(30)
+        if step_input(player, objects, grid, bits, traps):
+            outcome = "completed"
+            break
+        if player.health <= 0:
+            outcome = "fell" if player.rect.y > HEIGHT else "fire"
+            break
 
-    # Display game over text
-    font = pygame.font.Font(None, 74)
-    text = font.render("GAME OVER", True, (255, 0, 0))
-    text_rect = text.get_rect(center=(WIDTH//2, HEIGHT//2 - 50))
+    return outcome, frames, player
+
+
+def simulate_level(level, inputs, character="snowl", max_frames=None):
+    """Play a level without rendering or frame limiting, driven by per-frame input bitmasks"""
+    outcome, frames, player = play_inputs(level, inputs, character, max_frames)
+    return {"level": level, "outcome": outcome, "frames": frames,
+            "health": player.health, "x": player.rect.x, "y": player.rect.y}
+
+
+# Input logs: a header, the player state the run ended in, then one input bitmask byte per physics tick
+INPUT_LOG_MAGIC = b"PINP"
+INPUT_LOG_VERSION = 1
+INPUT_LOG_HEADER = struct.Struct("<4sHH16sI")  # magic, version, level, character, ticks
+PLAYER_STATE = struct.Struct("<iiddiiiiii??")
+
+
+def player_state(player):
+    """Pack everything physics carries from tick to tick, for exact comparison between runs"""
+    return PLAYER_STATE.pack(player.rect.x, player.rect.y, player.x_vel, player.y_vel, player.fall_count,
+                             player.jump_count, player.health, player.animation_count, player.hit_count,
+                             player.immunity_frames, player.hit, player.direction == "left")
+
+
+class InputRecorder:
+    """Collects the input bitmask of every physics tick of one level attempt"""
+    def __init__(self, level, character):
+        self.level = level
+        self.character = character
+        self.inputs = bytearray()
+
+    def record(self, bits):
+        self.inputs.append(bits)
+
+    def save(self, directory, player):
+        """Write the log with the player's final state into directory; returns the file path"""
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = join(directory, f"level{self.level}-{stamp}.inputs")
+        count = 1
+        while os.path.exists(path):
+            count += 1
+            path = join(directory, f"level{self.level}-{stamp}-{count}.inputs")
+        with open(path, "wb") as f:
+            f.write(INPUT_LOG_HEADER.pack(INPUT_LOG_MAGIC, INPUT_LOG_VERSION, self.level,
+                                          self.character.encode(), len(self.inputs)))
+            f.write(player_state(player))
+            f.write(self.inputs)
+        return path
+
+
+def read_input_log(path):
+    """Load an input log as a dict of level, character, inputs (bytes) and the recorded final state"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, level, character, ticks = INPUT_LOG_HEADER.unpack_from(data)
+    if magic != INPUT_LOG_MAGIC or version != INPUT_LOG_VERSION:
+        raise ValueError(f"{path} is not a version {INPUT_LOG_VERSION} input log")
+    start = INPUT_LOG_HEADER.size + PLAYER_STATE.size
+    inputs = data[start:start + ticks]
+    if len(inputs) != ticks:
+        raise ValueError(f"{path} is truncated")
+    return {"level": level, "character": character.rstrip(b"\0").decode(), "inputs": inputs,
+            "state": data[INPUT_LOG_HEADER.size:start]}
+
+
+def replay_input_log(path):
+    """Play a recorded run headless and check the player ends in exactly the recorded state"""
+    log = read_input_log(path)
+    outcome, frames, player = play_inputs(log["level"], log["inputs"], log["character"])
+    state = player_state(player)
+    return {"level": log["level"], "outcome": outcome, "frames": frames, "ticks": len(log["inputs"]),
+            "match": state == log["state"], "recorded": PLAYER_STATE.unpack(log["state"]),
+            "replayed": PLAYER_STATE.unpack(state)}
+
+
+class Scene:
+    """Full-screen state played one timed step at a time.
+
+    Each step is a (draw(window), milliseconds to show it) pair. With keys, the
+    scene ends with keys[key] on the first matching key press; without keys it
+    ends with True after the last step.
+    """
+    def __init__(self, steps, keys=None):
+        self.steps = steps
+        self.keys = keys
+
+
+def now_ms():
+    return time.perf_counter() * 1000
+
+
+def run_scene(window, scene):
+    """Play a scene, sleeping on the event queue between steps; returns False if the window is closed"""
+    steps = iter(scene.steps)
+    # perf_counter rather than pygame.time.get_ticks, which stays at 0 until pygame's timer is started
+    wake = now_ms()
+    finished = False
 
-    restart_font = pygame.font.Font(None, 36)
-    restart_text = restart_font.render("Press R to Restart", True, (255, 255, 255))
-    restart_rect = restart_text.get_rect(center=(WIDTH//2, HEIGHT//2 + 50))
+    while True:
+        now = now_ms()
+        if not finished and now >= wake:
+            step = next(steps, None)
+            if step is None:
+                finished = True
+                if scene.keys is None:
+                    return True
+            else:
+                draw_step, duration = step
+                draw_step(window)
+                pygame.display.update()
+                wake = now + duration
+                continue
 
-    quit_text = restart_font.render("Press Q to Quit", True, (255, 255, 255))
-    quit_rect = quit_text.get_rect(center=(WIDTH//2, HEIGHT//2 + 100))
+        # Block until the next step is due (or forever once only keys remain), waking up for events
+        if finished:
+            events = [pygame.event.wait()]
+        else:
+            events = [pygame.event.wait(max(1, math.ceil(wake - now)))]
+        events += pygame.event.get()
 
-    # Fill with dark background
-    window.fill((20, 20, 20))
-    window.blit(text, text_rect)
-    window.blit(restart_text, restart_rect)
-    window.blit(quit_text, quit_rect)
-    pygame.display.update()
-
-    # Wait for player input
-    waiting = True
-    while waiting:
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 return False
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_r:
-                    return True  # Restart game
-                if event.key == pygame.K_q:
-                    return False  # Quit game
-    return False
+            if event.type == pygame.KEYDOWN and scene.keys and event.key in scene.keys:
+                return scene.keys[event.key]
 
 
-def show_level_complete(window, level):
-    """Display level completion screen with celebration effect"""
-    # Create overlay for transition
-    overlay = pygame.Surface((WIDTH, HEIGHT))
-    overlay.fill((0, 50, 0))  # Dark green tint for success
+def pause_step(pause_ms):
+    """Step that leaves the window as it is for a while"""
+    return lambda window: None, pause_ms
 
-    # Fade in effect
-    for alpha in range(0, 180, 15):
-        overlay.set_alpha(alpha)
-        window.blit(overlay, (0, 0))
-        pygame.display.update()
-        pygame.time.delay(20)
 
-    # Display completion message
-    font = pygame.font.Font(None, 74)
-    text = font.render(f"LEVEL {level} COMPLETE!", True, (0, 255, 0))
-    text_rect = text.get_rect(center=(WIDTH//2, HEIGHT//2 - 50))
+def fade_steps(color, alphas, step_ms, under=None):
+    """Steps that blit a translucent overlay over the window, one alpha value per step"""
+    overlay = pygame.Surface((WIDTH, HEIGHT))
+    overlay.fill(color)
 
-    continue_font = pygame.font.Font(None, 36)
-    continue_text = continue_font.render("Press ENTER to Continue", True, (255, 255, 255))
-    continue_rect = continue_text.get_rect(center=(WIDTH//2, HEIGHT//2 + 50))
+    def fade_to(alpha):
+        def draw_step(window):
+            if under is not None:
+                under(window)
+            overlay.set_alpha(alpha)
+            window.blit(overlay, (0, 0))
+        return draw_step
 
-    # Fill with dark background
-    window.fill((10, 30, 10))
-    window.blit(text, text_rect)
-    window.blit(continue_text, continue_rect)
-    pygame.display.update()
+    return [(fade_to(alpha), step_ms) for alpha in alphas]
 
-    # Wait for player input
-    waiting = True
-    while waiting:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                return False
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_RETURN:
-                    return True  # Continue to next level
-    return False
 
+def message_step(fill_color, lines):
+    """Step that clears the window and draws (text, font size, color, center) lines"""
+    rendered = [(get_font(size).render(text, True, color), center) for text, size, color, center in lines]
 
-def show_victory_screen(window):
-    """Display final victory screen after beating all levels"""
-    # Create golden overlay for victory
-    overlay = pygame.Surface((WIDTH, HEIGHT))
-    overlay.fill((50, 40, 0))
+    def draw_step(window):
+        window.fill(fill_color)
+        for text, center in rendered:
+            window.blit(text, text.get_rect(center=center))
+    return draw_step
 
-    # Fade in effect
-    for alpha in range(0, 200, 10):
-        overlay.set_alpha(alpha)
-        window.blit(overlay, (0, 0))
-        pygame.display.update()
-        pygame.time.delay(25)
 
-    # Display victory message
-    font = pygame.font.Font(None, 90)
-    text = font.render("YOU WIN!", True, (255, 215, 0))
-    text_rect = text.get_rect(center=(WIDTH//2, HEIGHT//2 - 80))
+def show_game_over(window, pause_ms=0):
+    """Display game over screen with fade-in effect"""
+    steps = [pause_step(pause_ms)]
+    steps += fade_steps((0, 0, 0), range(0, 200, 10), 30)
+    steps.append((message_step((20, 20, 20), [
+        ("GAME OVER", 74, (255, 0, 0), (WIDTH//2, HEIGHT//2 - 50)),
+        ("Press R to Restart", 36, (255, 255, 255), (WIDTH//2, HEIGHT//2 + 50)),
+        ("Press Q to Quit", 36, (255, 255, 255), (WIDTH//2, HEIGHT//2 + 100)),
+    ]), 0))
 
-    subtitle_font = pygame.font.Font(None, 48)
-    subtitle = subtitle_font.render("All Levels Complete!", True, (255, 255, 255))
-    subtitle_rect = subtitle.get_rect(center=(WIDTH//2, HEIGHT//2 + 20))
+    # R restarts the game, Q quits
+    return run_scene(window, Scene(steps, {pygame.K_r: True, pygame.K_q: False}))
 
-    restart_font = pygame.font.Font(None, 36)
-    restart_text = restart_font.render("Press R to Play Again", True, (200, 200, 200))
-    restart_rect = restart_text.get_rect(center=(WIDTH//2, HEIGHT//2 + 100))
 
-    # Fill with dark background
-    window.fill((0, 0, 0))
-    window.blit(text, text_rect)
-    window.blit(subtitle, subtitle_rect)
-    window.blit(restart_text, restart_rect)
-    pygame.display.update()
-
-    # Wait for player input
-    waiting = True
-    while waiting:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                return False
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_r:
-                    return True  # Restart from level 1
-    return False
+def show_level_complete(window, level, pause_ms=0):
+    """Display level completion screen with celebration effect"""
+    steps = [pause_step(pause_ms)]
+    steps += fade_steps((0, 50, 0), range(0, 180, 15), 20)  # Dark green tint for success
+    steps.append((message_step((10, 30, 10), [
+        (f"LEVEL {level} COMPLETE!", 74, (0, 255, 0), (WIDTH//2, HEIGHT//2 - 50)),
+        ("Press ENTER to Continue", 36, (255, 255, 255), (WIDTH//2, HEIGHT//2 + 50)),
+    ]), 0))
 
+    # ENTER continues to the next level
+    return run_scene(window, Scene(steps, {pygame.K_RETURN: True}))
 
-def show_level_transition(window, level):
-    """Display transition screen between levels"""
-    # Create overlay
-    overlay = pygame.Surface((WIDTH, HEIGHT))
-    overlay.fill((0, 0, 50))  # Dark blue
 
-    # Fade in
-    for alpha in range(0, 255, 25):
-        overlay.set_alpha(alpha)
-        window.blit(overlay, (0, 0))
-        pygame.display.update()
-        pygame.time.delay(15)
+def show_victory_screen(window):
+    """Display final victory screen after beating all levels"""
+    steps = fade_steps((50, 40, 0), range(0, 200, 10), 25)  # Golden overlay for victory
+    steps.append((message_step((0, 0, 0), [
+        ("YOU WIN!", 90, (255, 215, 0), (WIDTH//2, HEIGHT//2 - 80)),
+        ("All Levels Complete!", 48, (255, 255, 255), (WIDTH//2, HEIGHT//2 + 20)),
+        ("Press R to Play Again", 36, (200, 200, 200), (WIDTH//2, HEIGHT//2 + 100)),
+    ]), 0))
 
-    # Display level number
-    font = pygame.font.Font(None, 100)
-    text = font.render(f"LEVEL {level}", True, (255, 255, 255))
-    text_rect = text.get_rect(center=(WIDTH//2, HEIGHT//2))
+    # R restarts from level 1
+    return run_scene(window, Scene(steps, {pygame.K_r: True}))
 
-    window.fill((0, 0, 30))
-    window.blit(text, text_rect)
-    pygame.display.update()
-    pygame.time.delay(1500)  # Show for 1.5 seconds
 
-    # Fade out
-    for alpha in range(255, 0, -25):
-        overlay.set_alpha(alpha)
-        window.fill((0, 0, 30))
-        window.blit(text, text_rect)
-        window.blit(overlay, (0, 0))
-        pygame.display.update()
-        pygame.time.delay(15)
+def show_level_transition(window, level):
+    """Display transition screen between levels"""
+    title = message_step((0, 0, 30), [(f"LEVEL {level}", 100, (255, 255, 255), (WIDTH//2, HEIGHT//2))])
+
+    # Fade in to dark blue, show the level number for 1.5 seconds, then fade it out
+    steps = fade_steps((0, 0, 50), range(0, 255, 25), 15)
+    steps.append((title, 1500))
+    steps += fade_steps((0, 0, 50), range(255, 0, -25), 15, under=title)
+    return run_scene(window, Scene(steps))
 
 
-def select_character(window):
+def select_character(window, preload=True):
     # Character list as tuples (display_name, asset_dir_name)
     character_options = [
         ("Snowl", "snowl"),
@@ -891,96 +2357,111 @@ def select_character(window):
         ("Pink Man", "PinkMan")
     ]
     idx = 0
-    font = pygame.font.Font(None, 36)
+    font = get_font(36)
     selecting = True
-    clock = pygame.time.Clock()
+
+    # Slot layout
+    slot_w = 120
+    slot_h = 160
+    gap = 40
+    total_w = len(character_options) * slot_w + (len(character_options) - 1) * gap
+    start_x = (WIDTH - total_w) // 2
+    y = 140
+
+    # Render text and thumbnails once instead of every frame
+    title = font.render("Select Character", True, (255, 255, 255))
+    title_rect = title.get_rect(center=(WIDTH//2, 60))
+    instr = font.render("Use ← → to choose, ENTER to confirm", True, (200, 200, 200))
+    thumbnails = [load_character_thumbnail(asset_dir, slot_w - 20, slot_h - 60)
+                  for _, asset_dir in character_options]
+    labels = [font.render(display_name, True, (255, 255, 255)) for display_name, _ in character_options]
+
+    # Warm the sprite cache for the highlighted character while the player is choosing
+    preloaded = set()
 
     while selecting:
-        clock.tick(FPS)
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                quit()
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_LEFT:
-                    idx = (idx - 1) % len(character_options)
-                if event.key == pygame.K_RIGHT:
-                    idx = (idx + 1) % len(character_options)
-                if event.key == pygame.K_RETURN:
-                    # Return the asset directory name for the selected character
-                    return character_options[idx][1]
-                if event.key == pygame.K_ESCAPE:
-                    return character_options[idx][1]
+        if preload and idx not in preloaded:
+            preload_sprite_sheets("MainCharacters", character_options[idx][1], 32, 32, True)
+            preloaded.add(idx)
 
         # Draw selection screen
         window.fill((30, 30, 40))
-        title = font.render("Select Character", True, (255, 255, 255))
-        title_rect = title.get_rect(center=(WIDTH//2, 60))
         window.blit(title, title_rect)
 
         # Draw slots
-        slot_w = 120
-        slot_h = 160
-        gap = 40
-        total_w = len(character_options) * slot_w + (len(character_options) - 1) * gap
-        start_x = (WIDTH - total_w) // 2
-        y = 140
-
         for i, (display_name, asset_dir) in enumerate(character_options):
             x = start_x + i * (slot_w + gap)
             rect = pygame.Rect(x, y, slot_w, slot_h)
             pygame.draw.rect(window, (80, 80, 80), rect)
 
-            # Try to draw character idle sprite if available from the corresponding asset folder
-            sprites = load_sprite_sheets("MainCharacters", asset_dir, 32, 32, True)
-            sprite = sprites.get("idle_right", [None])[0]
-            if sprite:
-                sprite_small = pygame.transform.scale(sprite, (slot_w - 20, slot_h - 60))
-                window.blit(sprite_small, (x + 10, y + 10))
+            # Draw the preloaded idle thumbnail if the character has one
+            if thumbnails[i]:
+                window.blit(thumbnails[i], (x + 10, y + 10))
             else:
                 # Draw placeholder box
                 pygame.draw.rect(window, (150, 150, 150), (x + 10, y + 10, slot_w - 20, slot_h - 60))
 
-            label = font.render(display_name, True, (255, 255, 255))
-            lbl_rect = label.get_rect(center=(x + slot_w//2, y + slot_h - 20))
-            window.blit(label, lbl_rect)
+            lbl_rect = labels[i].get_rect(center=(x + slot_w//2, y + slot_h - 20))
+            window.blit(labels[i], lbl_rect)
 
             if i == idx:
                 pygame.draw.rect(window, (255, 255, 0), rect, 4)
             else:
                 pygame.draw.rect(window, (0, 0, 0), rect, 2)
 
-        instr = font.render("Use ← → to choose, ENTER to confirm", True, (200, 200, 200))
         window.blit(instr, (WIDTH//2 - instr.get_width()//2, HEIGHT - 80))
 
         pygame.display.update()
 
+        # Nothing animates here, so sleep until the next input
+        for event in [pygame.event.wait()] + pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                quit()
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_LEFT:
+                    idx = (idx - 1) % len(character_options)
+                if event.key == pygame.K_RIGHT:
+                    idx = (idx + 1) % len(character_options)
+                if event.key == pygame.K_RETURN:
+                    # Return the asset directory name for the selected character
+                    return character_options[idx][1]
+                if event.key == pygame.K_ESCAPE:
+                    return character_options[idx][1]
+
 
-def main(window):
+def main(window, dirty_rects=False, profile=False, profile_out=None, record_dir=None):
     clock = pygame.time.Clock()
-    background, bg_image = get_background("Blue.png")
+    background = Background("Blue.png")
+    hud = Hud()
+
+    # Frame timings; --profile shows the overlay (F3 toggles it), samples are written out on exit when a path is given
+    profiler = FrameProfiler(show_overlay=profile, keep_all=bool(profile_out)) if profile or profile_out else None
+    if profile_out:
+        atexit.register(profiler.export, profile_out)
+    section = profiler.section if profiler is not None else nullcontext
 
     current_level = 1
 
     # Character selection before starting levels
     selected_char = select_character(window)
+    preloaded = None
 
     # Main game loop - cycles through all levels
     while True:
+        # Build the level in the background while the transition screen is showing
+        if preloaded is None or preloaded.level != current_level:
+            preloaded = preload_level(current_level)
+
         # Show level transition screen
-        show_level_transition(window, current_level)
+        if not show_level_transition(window, current_level):
+            break  # Window closed
 
         # Create level based on current level number
-        if current_level == 1:
-            objects = create_level_1()
-        elif current_level == 2:
-            objects = create_level_2()
-        elif current_level == 3:
-            objects = create_level_3()
-        elif current_level == 4:
-            objects = create_level_4()
-        elif current_level == 5:
-            objects = create_level_5()
+        if preloaded is not None:
+            # Only the chunks around the camera are turned into objects
+            world = preloaded.result()
+            preloaded = None
         else:
             # All 5 levels completed - show victory screen
             if show_victory_screen(window):
@@ -989,49 +2470,75 @@ def main(window):
             else:
                 break  # Exit game
 
+        # Fresh per level so the first frame after a transition screen is pushed in full
+        dirty = DirtyRects() if dirty_rects else None
+
         # Initialize player at starting position (pass selected character)
         player = Player(100, 100, 50, 50, character=selected_char)
         offset_x = 0  # Camera offset for scrolling
         scroll_area_width = 200  # Scroll when player gets this close to edge
+        world.update(offset_x)
 
         run = True
         level_completed = False
 
+        # Inputs are sampled once per physics tick so the attempt can be replayed exactly
+        recorder = InputRecorder(current_level, selected_char) if record_dir else None
+        jump_pressed = False
+
+        # Physics time owed to the simulation; start with one tick so the first frame has a sprite
+        clock.tick()
+        accumulator = TICK_MS
+        prev_offset_x = offset_x
+        if profiler is not None:
+            profiler.restart()
+
         # Level game loop
         while run:
-            clock.tick(FPS)  # Maintain consistent frame rate
+            accumulator += min(clock.tick(MAX_RENDER_FPS), MAX_FRAME_MS)
 
             # Handle events
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
+                    if recorder is not None:
+                        recorder.save(record_dir, player)
                     pygame.quit()
                     quit()
 
                 if event.type == pygame.KEYDOWN:
-                    # Jump on spacebar (allow double jump)
-                    if event.key == pygame.K_SPACE and player.jump_count < 2:
-                        player.jump()
-
-            # Update player physics
-            player.loop(FPS)
-
-            # Update all animated objects (fire traps)
-            for obj in objects:
-                if isinstance(obj, Fire):
-                    obj.loop()
-
-            # Handle player movement and check for level completion
-            level_completed = handle_move(player, objects)
-
-            # Check if player fell off the map (instant death)
-            if player.rect.y > HEIGHT:
-                player.health = 0
+                    # Jump on spacebar at the next physics tick (allow double jump)
+                    if event.key == pygame.K_SPACE:
+                        jump_pressed = True
+                    if event.key == pygame.K_F3 and profiler is not None:
+                        profiler.show_overlay = not profiler.show_overlay
+
+            # Run physics in fixed ticks, however long the last frame took
+            while accumulator >= TICK_MS and not level_completed and player.health > 0:
+                accumulator -= TICK_MS
+                prev_offset_x = offset_x
+
+                # Update physics and check for level completion. Collision uses the
+                # individual blocks, drawing uses the baked terrain chunks.
+                bits = read_input(jump_pressed)
+                jump_pressed = False
+                if recorder is not None:
+                    recorder.record(bits)
+                level_completed = step_input(player, world.objects, world.grid, bits, world.traps, profiler)
+
+                # Camera scrolling - follow player horizontally
+                if ((player.rect.right - offset_x >= WIDTH - scroll_area_width) and player.x_vel > 0) or (
+                        (player.rect.left - offset_x <= scroll_area_width) and player.x_vel < 0):
+                    offset_x += player.x_vel
+                world.update(offset_x)
+
+            if recorder is not None and (player.health <= 0 or level_completed):
+                recorder.save(record_dir, player)
 
             # Check for game over condition
             if player.health <= 0:
-                draw(window, background, bg_image, player, objects, offset_x, current_level)
-                pygame.time.wait(1000)  # Brief pause to show death
-                if show_game_over(window):
+                draw(window, background, player, world.drawables, offset_x, current_level, world.camera, hud, dirty)
+                preloaded = preload_level(1)
+                if show_game_over(window, pause_ms=1000):  # Brief pause to show death first
                     current_level = 1  # Restart from level 1 on death
                     break
                 else:
@@ -1040,22 +2547,23 @@ def main(window):
 
             # Check for level completion
             if level_completed:
-                draw(window, background, bg_image, player, objects, offset_x, current_level)
-                pygame.time.wait(800)  # Brief celebration pause
-                if show_level_complete(window, current_level):
+                draw(window, background, player, world.drawables, offset_x, current_level, world.camera, hud, dirty)
+                preloaded = preload_level(current_level + 1)
+                if show_level_complete(window, current_level, pause_ms=800):  # Brief celebration pause first
                     current_level += 1  # Advance to next level
                     break
                 else:
                     pygame.quit()
                     quit()
 
-            # Draw everything
-            draw(window, background, bg_image, player, objects, offset_x, current_level)
-
-            # Camera scrolling - follow player horizontally
-            if ((player.rect.right - offset_x >= WIDTH - scroll_area_width) and player.x_vel > 0) or (
-                    (player.rect.left - offset_x <= scroll_area_width) and player.x_vel < 0):
-                offset_x += player.x_vel
+            # Draw everything, part way between the last two physics ticks
+            alpha = accumulator / TICK_MS
+            view_x = round(prev_offset_x + (offset_x - prev_offset_x) * alpha)
+            with section("draw"):
+                draw(window, background, player, world.drawables, view_x, current_level, world.camera, hud, dirty,
+                     alpha, profiler)
+            if profiler is not None:
+                profiler.end_frame()
 
     # Clean exit
     pygame.quit()
@@ -1063,4 +2571,7 @@ def main(window):
 
 
 if __name__ == "__main__":
-    main(window)
\ No newline at end of file
+    args = sys.argv[1:]
+    options = dict(arg[2:].split("=", 1) for arg in args if arg.startswith("--") and "=" in arg)
+    main(init_app(), dirty_rects="--dirty-rects" in args, profile="--profile" in args,
+         profile_out=options.get("profile-out"), record_dir=options.get("record"))
\ No newline at end of file
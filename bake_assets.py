@@ -0,0 +1,31 @@
+"""Bake every sprite sheet, terrain tile and background into one atlas image plus a JSON index.
+
+The game loads the atlas at startup instead of reading and scaling dozens of
+small PNGs. Run it again after changing anything in the asset folders.
+Example: python bake_assets.py
+"""
+import sys
+import time
+import argparse
+
+import Main
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", default=Main.ATLAS_IMAGE)
+    parser.add_argument("--index", default=Main.ATLAS_INDEX)
+    parser.add_argument("--width", type=int, default=Main.ATLAS_WIDTH, help="atlas width in pixels")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    index = Main.bake_atlas(args.image, args.index, args.width)
+    frames = sum(len(rects) for animations in index["sheets"].values() for rects in animations.values())
+    print(f"Baked {len(index['sheets'])} sprite sheets ({frames} frames), {len(index['blocks'])} tiles and "
+          f"{len(index['backgrounds'])} backgrounds "
+          f"into a {index['width']}x{index['height']} atlas in {time.perf_counter() - start:.2f}s")
+    print(f"Wrote {args.image} and {args.index}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
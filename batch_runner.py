@@ -0,0 +1,99 @@
+"""Play many headless level runs in parallel and summarize how they ended.
+
+Example: python batch_runner.py --levels 3 4 --runs 2000
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import multiprocessing
+
+import Main
+
+
+def random_inputs(seed, frames, jump_chance=0.06, left_chance=0.05):
+    """Mostly run right, with random jumps and the odd step back"""
+    rng = random.Random(seed)
+    for _ in range(frames):
+        bits = Main.INPUT_RIGHT
+        if rng.random() < left_chance:
+            bits = Main.INPUT_LEFT
+        if rng.random() < jump_chance:
+            bits |= Main.INPUT_JUMP
+        yield bits
+
+
+def run_job(job):
+    """Run one playthrough; job is (level, seed, inputs) where inputs may be None for random play"""
+    level, seed, inputs, options = job
+    if inputs is None:
+        inputs = random_inputs(seed, options["frames"], options["jump_chance"], options["left_chance"])
+    result = Main.simulate_level(level, inputs, options["character"], options["frames"])
+    result["seed"] = seed
+    return result
+
+
+def run_batch(jobs, workers=None):
+    """Spread jobs over a process pool (one worker per core by default) and return all results"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [run_job(job) for job in jobs]
+    with multiprocessing.Pool(workers) as pool:
+        return list(pool.imap_unordered(run_job, jobs, chunksize=8))
+
+
+def summarize(results):
+    """Count outcomes and average frames per level"""
+    summary = {}
+    for result in results:
+        level = summary.setdefault(result["level"], {"runs": 0, "frames": 0, "outcomes": {}})
+        level["runs"] += 1
+        level["frames"] += result["frames"]
+        level["outcomes"][result["outcome"]] = level["outcomes"].get(result["outcome"], 0) + 1
+    for level in summary.values():
+        level["avg_frames"] = level.pop("frames") / level["runs"]
+    return dict(sorted(summary.items()))
+
+
+def load_scripts(path):
+    """Read scripted runs, one per line as comma separated input bitmasks"""
+    with open(path) as f:
+        return [[int(bits) for bits in line.split(",")] for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", type=int, nargs="+", default=list(range(1, Main.level_count() + 1)))
+    parser.add_argument("--runs", type=int, default=200, help="random runs per level")
+    parser.add_argument("--frames", type=int, default=3600, help="frame limit per run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jump-chance", type=float, default=0.06)
+    parser.add_argument("--left-chance", type=float, default=0.05)
+    parser.add_argument("--character", default="snowl")
+    parser.add_argument("--scripts", help="file of scripted runs to play instead of random input")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", help="write every run result to this JSON file")
+    args = parser.parse_args(argv)
+
+    options = {"frames": args.frames, "jump_chance": args.jump_chance,
+               "left_chance": args.left_chance, "character": args.character}
+    if args.scripts:
+        scripts = load_scripts(args.scripts)
+        jobs = [(level, i, script, options) for level in args.levels for i, script in enumerate(scripts)]
+    else:
+        jobs = [(level, args.seed + i, None, options) for level in args.levels for i in range(args.runs)]
+
+    results = run_batch(jobs, args.workers)
+    summary = summarize(results)
+    for level, stats in summary.items():
+        outcomes = ", ".join(f"{name} {count}" for name, count in sorted(stats["outcomes"].items()))
+        print(f"Level {level}: {stats['runs']} runs, {outcomes}, {stats['avg_frames']:.0f} frames avg")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "runs": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
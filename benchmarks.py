@@ -0,0 +1,205 @@
+"""Time the loading, physics and drawing hot paths headless and compare them to a stored baseline.
+
+Example: python benchmarks.py --save-baseline, then after a change: python benchmarks.py
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+import pygame
+import Main
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".benchmarks", "baseline.json")
+
+# Positions the player is dropped at for handle_move, as fractions of the level width
+PROBE_POINTS = 32
+
+
+def measure(func, number, repeat):
+    """Per-call times in microseconds for repeat rounds of number calls each"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) * 1e6 / number)
+    return {"median_us": statistics.median(times), "min_us": min(times), "calls": number * repeat}
+
+
+def level_bounds(objects):
+    return min(obj.rect.left for obj in objects), max(obj.rect.right for obj in objects)
+
+
+def bench_sprite_sheets(number, repeat):
+    """Cold sprite loads: every animation of every character plus the fire trap, all caches cleared each call.
+
+    Timed from the asset folders, and from the baked atlas as a separate case when one exists.
+    """
+    characters = [name for name in sorted(os.listdir(os.path.join("assets", "MainCharacters")))
+                  if os.path.isdir(os.path.join("assets", "MainCharacters", name))]
+
+    def load_all():
+        Main.invalidate_sprite_cache()
+        for character in characters:
+            sprites = Main.load_sprite_sheets("MainCharacters", character, 32, 32, True)
+            for name in sprites:
+                sprites[name]  # Character sets are lazy; make them decode every animation
+        Main.load_sprite_sheets("Traps", "Fire", 16, 32)
+        Main.get_block(96)
+
+    results = {}
+    Main.USE_ATLAS = False
+    try:
+        results["load_sprites_folders"] = measure(load_all, max(1, number // 20), repeat)
+    finally:
+        Main.USE_ATLAS = True
+    if os.path.isfile(Main.ATLAS_IMAGE):
+        results["load_sprites_atlas"] = measure(load_all, max(1, number // 20), repeat)
+    Main.invalidate_sprite_cache()
+    return results
+
+
+def bench_levels(number, repeat):
+    """Build every level and time the physics and drawing done for it each frame"""
+    results = {}
+    window = pygame.Surface((Main.WIDTH, Main.HEIGHT))
+    background = Main.Background("Blue.png")
+    hud = Main.Hud()
+    right = Main.ScriptedKeys(Main.INPUT_RIGHT)
+
+    for level, builder in enumerate(Main.LEVEL_BUILDERS, 1):
+        results[f"create_level_{level}"] = measure(builder, max(1, number // 10), repeat)
+
+        objects = builder()
+        grid = Main.SpatialGrid(objects)
+        player = Main.Player(100, 100, 50, 50, character="snowl")
+        player.loop(Main.FPS)  # Sets the sprite and mask handle_move checks against
+        left, width = level_bounds(objects)
+        width -= left
+        probes = [(left + width * i // PROBE_POINTS, Main.HEIGHT - 96 * 2 - player.rect.height)
+                  for i in range(PROBE_POINTS)]
+
+        def move(grid=grid):
+            # Reset the player each call so every probe point costs the same every round
+            for x, y in probes:
+                player.rect.topleft = (x, y)
+                player.prev_pos = (x, y)
+                player.y_vel = 1
+                Main.handle_move(player, objects, grid, right)
+
+        results[f"handle_move_level_{level}"] = per_call(measure(move, number, repeat), len(probes))
+        results[f"handle_move_scan_level_{level}"] = per_call(
+            measure(lambda: move(None), max(1, number // 10), repeat), len(probes))
+
+        fires = [obj for obj in objects if isinstance(obj, Main.Fire)]
+        if fires:
+            def sweep():
+                for fire in fires:
+                    fire.loop()
+            results[f"fire_loop_level_{level}"] = measure(sweep, number * 10, repeat)
+
+            traps = Main.TrapSystem(fires)
+            results[f"trap_step_level_{level}"] = measure(lambda: traps.step(grid), number * 10, repeat)
+
+        drawables = Main.bake_terrain(objects)
+        camera = Main.CameraIndex(drawables)
+        offsets = [left + width * i // 8 for i in range(8)]
+
+        def draw():
+            for offset_x in offsets:
+                Main.draw(window, background, player, drawables, offset_x, level, camera, hud)
+
+        results[f"draw_level_{level}"] = per_call(measure(draw, max(1, number // 10), repeat), len(offsets))
+
+    return results
+
+
+def per_call(result, calls):
+    """Turn timings of a batch of calls into timings of one call"""
+    result["median_us"] /= calls
+    result["min_us"] /= calls
+    result["calls"] *= calls
+    return result
+
+
+def run(number, repeat):
+    results = {}
+    results.update(bench_sprite_sheets(number, repeat))
+    results.update(bench_levels(number, repeat))
+    return results
+
+
+def is_hot(name):
+    """Benchmarks of work done every frame; only these fail the baseline check"""
+    return name.startswith(("handle_move_level", "fire_loop", "trap_step", "draw_level"))
+
+
+def compare(results, baseline, tolerance):
+    """Print each benchmark against the baseline; returns the names of hot paths that got slower"""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:28} {result['median_us']:12.1f} us  (new)")
+            continue
+        change = result["median_us"] / old["median_us"] - 1
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION" if is_hot(name) else "  slower"
+            if is_hot(name):
+                regressions.append(name)
+        print(f"{name:28} {result['median_us']:12.1f} us  {change:+7.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200, help="calls per timing round")
+    parser.add_argument("--repeat", type=int, default=5, help="timing rounds; the median round is reported")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing, 0.25 = 25%%")
+    args = parser.parse_args(argv)
+
+    # draw() presents to a display and loads should convert like the game's; the dummy driver is enough
+    Main.init_app(headless=True)
+    results = run(args.number, args.repeat)
+    report = {"python": sys.version.split()[0], "pygame": pygame.version.ver, "results": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        for name, result in results.items():
+            print(f"{name:28} {result['median_us']:12.1f} us")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        for name, result in results.items():
+            print(f"{name:28} {result['median_us']:12.1f} us")
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} hot path(s) slower than the baseline by more than {args.tolerance:.0%}: "
+              + ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    # Paths to the assets are relative to the game folder
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,35 @@
+"""Replay recorded input logs headless and check they end in the recorded player state.
+
+Record with: python Main.py --record=recordings
+Example: python replay.py recordings/*.inputs
+"""
+import sys
+import time
+import argparse
+
+import Main
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("logs", nargs="+", help="input log files written by --record")
+    args = parser.parse_args(argv)
+
+    mismatches = 0
+    for path in args.logs:
+        start = time.perf_counter()
+        result = Main.replay_input_log(path)
+        elapsed = time.perf_counter() - start
+        speed = result["frames"] / Main.FPS / max(elapsed, 1e-9)
+        status = "ok" if result["match"] else "MISMATCH"
+        print(f"{path}: level {result['level']}, {result['outcome']} after {result['frames']}/{result['ticks']} ticks, "
+              f"{status} ({speed:.0f}x real time)")
+        if not result["match"]:
+            mismatches += 1
+            print(f"  recorded {result['recorded']}")
+            print(f"  replayed {result['replayed']}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))